@@ -0,0 +1,6 @@
+import os
+
+from src import create_app
+from src.asgi import AsgiApp
+
+app = AsgiApp(create_app(os.path.abspath("config.json")))
@@ -0,0 +1,203 @@
+"""Checks the Redis cache backend against a local stand-in speaking the Redis protocol, no Redis server is needed.
+
+Run from the repository root with `python -m scripts.check_redis`. The stand-in answers over a real socket with every
+reply type the client parses, requires a password and records the commands it receives and how they were batched. The
+checks cover the reply parser, pipelining, AUTH and SELECT from the URL, locks, and skipping a server that went down
+until it is back.
+"""
+
+import contextlib
+import socket
+import socketserver
+import threading
+import time
+from typing import override
+
+from src.lib.remote import Connection, RedisCache, RedisError
+
+PASSWORD: bytes = b"secret"
+
+type Value = bytes | int | str | list[Value] | None
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    allow_reuse_address: bool = True
+    daemon_threads: bool = True
+
+    def __init__(self, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), Handler)
+        self.data: dict[tuple[bytes, bytes], tuple[bytes, float | None]] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.commands: list[list[bytes]] = []
+        self.batches: list[int] = []
+        self.connections: list[socket.socket] = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def stop(self) -> None:
+        """Stops listening and drops the open connections, as a server going down would."""
+        self.shutdown()
+        self.server_close()
+        for connection in list(self.connections):
+            with contextlib.suppress(OSError):
+                connection.shutdown(socket.SHUT_RDWR)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    server: FakeRedis  # pyright: ignore[reportIncompatibleVariableOverride]
+
+    @override
+    def handle(self) -> None:
+        buffer: bytes = b""
+        authenticated: bool = False
+        database: bytes = b"0"
+        self.server.connections.append(self.request)
+        while data := self.request.recv(65536):
+            buffer += data
+            commands: list[list[bytes]] = []
+            while (parsed := self.__parse(buffer)) is not None:
+                command, buffer = parsed
+                commands.append(command)
+            self.server.batches.append(len(commands))
+            out: bytearray = bytearray()
+            for command in commands:
+                self.server.commands.append(command)
+                name: bytes = command[0].upper()
+                if name == b"AUTH":
+                    authenticated = command[-1] == PASSWORD
+                    out += b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n"
+                elif not authenticated:
+                    out += b"-NOAUTH Authentication required\r\n"
+                elif name == b"SELECT":
+                    database = command[1]
+                    out += b"+OK\r\n"
+                else:
+                    out += self.__encode(self.__run(database, command))
+            self.request.sendall(out)
+        self.server.connections.remove(self.request)
+
+    def __run(self, database: bytes, command: list[bytes]) -> Value | RedisError:
+        name: bytes = command[0].upper()
+        with self.server.lock:
+            match name:
+                case b"GET":
+                    return self.__get(database, command[1])
+                case b"MGET":
+                    return [self.__get(database, i) for i in command[1:]]
+                case b"SET":
+                    options: list[bytes] = [i.upper() for i in command[3:]]
+                    if b"NX" in options and self.__get(database, command[1]) is not None:
+                        return None
+                    ttl: float | None = None
+                    if b"PX" in options:
+                        ttl = time.time() + int(command[3 + options.index(b"PX") + 1]) / 1000
+                    self.server.data[database, command[1]] = (command[2], ttl)
+                    return "OK"
+                case b"DEL":
+                    return sum(self.server.data.pop((database, i), None) is not None for i in command[1:])
+                case b"ECHO":
+                    # Nested arrays and integers, the cache itself never gets them.
+                    return [command[1], [len(command[1]), None]]
+                case _:
+                    return RedisError(f"ERR unknown command '{name.decode()}'")
+
+    def __get(self, database: bytes, key: bytes) -> bytes | None:
+        value, expires = self.server.data.get((database, key), (None, None))
+        if expires is not None and expires < time.time():
+            del self.server.data[database, key]
+            return None
+        return value
+
+    def __encode(self, value: Value | RedisError) -> bytes:
+        match value:
+            case None:
+                return b"$-1\r\n"
+            case RedisError():
+                return b"-" + str(value).encode() + b"\r\n"
+            case str():
+                return b"+" + value.encode() + b"\r\n"
+            case int():
+                return b":%d\r\n" % value
+            case bytes():
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            case list():
+                return b"*%d\r\n" % len(value) + b"".join(self.__encode(i) for i in value)
+
+    def __parse(self, buffer: bytes) -> tuple[list[bytes], bytes] | None:
+        if not buffer.startswith(b"*") or b"\r\n" not in buffer:
+            return None
+        header, rest = buffer.split(b"\r\n", 1)
+        command: list[bytes] = []
+        for _ in range(int(header[1:])):
+            if b"\r\n" not in rest:
+                return None
+            size, rest = rest.split(b"\r\n", 1)
+            length: int = int(size[1:])
+            if len(rest) < length + 2:
+                return None
+            command.append(rest[:length])
+            rest = rest[length + 2 :]
+        return command, rest
+
+
+def check(condition: bool, what: str) -> None:  # noqa: FBT001
+    print(("ok    " if condition else "FAIL  ") + what)
+    if not condition:
+        raise SystemExit(1)
+
+
+def main() -> None:
+    server: FakeRedis = FakeRedis()
+    port: int = server.port
+
+    connection: Connection = Connection(("127.0.0.1", port), 1)
+    server.batches.clear()
+    replies = connection.send(("AUTH", PASSWORD), ("SET", "k", "v"), ("GET", "k"), ("GET", "missing"), ("ECHO", "hi"))
+    check(replies == [b"OK", b"OK", b"v", None, [b"hi", [2, None]]], "simple, bulk, null, integer and nested array replies")
+    check(server.batches[-1] == 5, "commands sent together reach the server in one write")
+    try:
+        connection.send(("NOPE",))
+        check(False, "error replies raise RedisError")  # noqa: FBT003
+    except RedisError as e:
+        check("unknown command" in str(e), "error replies raise RedisError")
+    connection.close()
+
+    cache: RedisCache = RedisCache(f"redis://:{PASSWORD.decode()}@127.0.0.1:{port}/2", retry=0.3)
+    server.commands.clear()
+    cache.set("a", b"1", 60)
+    check(cache.get("a") == b"1", "values round trip")
+    check([i[0] for i in server.commands[:2]] == [b"AUTH", b"SELECT"], "a new connection sends AUTH then SELECT")
+    check((b"2", b"phice:1:a") in server.data, "keys are namespaced and kept in the selected database")
+    check(cache.get_many(["a", "b"]) == [b"1", None], "get_many answers from a single MGET")
+    check(sum(i[0] == b"MGET" for i in server.commands) == 2, "every read is one MGET")
+    cache.set("short", b"1", 0.05)
+    time.sleep(0.1)
+    check(cache.get("short") is None, "entries expire after their TTL")
+    check(cache.lock("l", 5) and not cache.lock("l", 5), "a lock is only granted once")
+    cache.unlock("l")
+    check(cache.lock("l", 5), "an unlocked lock is granted again")
+
+    wrong: RedisCache = RedisCache(f"redis://:wrong@127.0.0.1:{port}", retry=0.3)
+    check(wrong.get("a") is None and wrong.stats()["errors"] == 1, "a refused AUTH is a miss and an error")
+
+    server.stop()
+    start: float = time.time()
+    check(cache.get("a") is None, "a server that went down is a miss")
+    errors: int = cache.stats()["errors"]
+    check(cache.get("a") is None and cache.stats()["errors"] == errors, "it is not contacted again for `retry` seconds")
+    check(time.time() - start < 0.3, "misses do not wait on the server")
+
+    server = FakeRedis(port)
+    cache.set("a", b"2", 60)
+    check(cache.get("a") is None, "a server back up is still skipped until `retry` has passed")
+    time.sleep(0.35)
+    cache.set("a", b"3", 60)
+    check(cache.get("a") == b"3", "it is used again once `retry` has passed")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
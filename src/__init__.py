@@ -1,10 +1,25 @@
 import json
 from importlib import import_module
+from typing import Any, cast
 
 from flask import Flask
 
 from .jinja_filters import FILTERS
 from .jinja_globals import GLOBALS
+from .lib.api import RESPONSE_TTL, ROUTE_TTL, responses, routes
+from .lib.cache import Cache, store
+from .lib.expiry import expiry
+from .lib.extractor import PAGINATION, PARSED_TTL, REPLIES, parsed
+from .lib.flight import flights
+from .lib.fragments import fragments
+from .lib.limiter import limiter
+from .lib.media import media
+from .lib.pages import PAGE_TTL, pages
+from .lib.paging import sizes
+from .lib.pool import pool
+from .lib.prefetch import prefetcher
+from .lib.remote import remote
+from .lib.video import readahead
 
 
 def create_app(config_file: str) -> Flask:
@@ -16,7 +31,46 @@ def create_app(config_file: str) -> Flask:
     app.jinja_env.filters.update(FILTERS)
     app.jinja_env.globals.update(GLOBALS)
 
-    for route in ("albums", "cdn", "error", "groups", "home", "posts", "profile", "search", "settings", "share"):
+    config: dict[str, Any] = cast("dict[str, Any]", app.config)
+    config.setdefault("ENABLE_STATS", False)
+    # Configs written before a setting existed get its default, so that it is saved and part of the page cache key.
+    config["DEFAULT_SETTINGS"].setdefault("replies", "off")
+    pool.configure(**config.get("UPSTREAM_POOL", {}))
+    flights.configure(**config.get("SINGLE_FLIGHT", {}))
+    limiter.configure(**config.get("UPSTREAM_LIMIT", {}))
+    response_cache: dict[str, Any] = config.get("RESPONSE_CACHE", {})
+    responses.configure(response_cache.get("max_bytes", responses.max_bytes))
+    RESPONSE_TTL.update(response_cache.get("ttl", {}))
+    parsed_cache: dict[str, Any] = config.get("PARSED_CACHE", {})
+    parsed.configure(parsed_cache.get("max_bytes", parsed.max_bytes))
+    PARSED_TTL.update(parsed_cache.get("ttl", {}))
+    PAGINATION.update(config.get("PAGINATION", {}))
+    sizes.configure(**config.get("PAGE_SIZE", {}))
+    REPLIES.update(config.get("REPLIES", {}))
+    route_cache: dict[str, Any] = config.get("ROUTE_CACHE", {})
+    routes.configure(route_cache.get("path"))
+    ROUTE_TTL.update(route_cache.get("ttl", {}))
+    fragments.configure(**config.get("FRAGMENT_CACHE", {}))
+    store.configure(**config.get("CACHE_STORE", {}))
+    remote.configure(**config.get("REDIS_CACHE", {}))
+    shared: Cache | None = remote if remote.url else store if store.path else None
+    if shared:
+        for cache in (responses, parsed, routes, fragments.fragments, pages.pages):
+            cache.share(shared)
+    if remote.url:
+        flights.share(remote)
+    media.configure(**config.get("MEDIA_CACHE", {}))
+    expiry.configure(**config.get("URL_EXPIRY", {}))
+    readahead.configure(**config.get("VIDEO_READAHEAD", {}))
+    prefetcher.configure(**config.get("PREFETCH", {}))
+    app.before_request(prefetcher.enter)
+    app.teardown_request(prefetcher.leave)
+    page_cache: dict[str, Any] = config.get("PAGE_CACHE", {})
+    pages.configure(**{k: v for k, v in page_cache.items() if k != "ttl"})
+    PAGE_TTL.update(page_cache.get("ttl", {}))
+    pages.init_app(app)
+
+    for route in ("albums", "cdn", "error", "groups", "home", "posts", "profile", "search", "settings", "share", "stats"):
         app.register_blueprint(import_module(f".routes.{route}", __name__).bp)
 
     return app
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import io
+import sys
+from collections.abc import Awaitable, Callable, Iterable, Iterator, MutableMapping
+from typing import Any
+
+from flask import Flask, request
+from flask.typing import ResponseReturnValue
+from werkzeug import Response
+from werkzeug.exceptions import HTTPException
+
+type Scope = MutableMapping[str, Any]
+type Message = MutableMapping[str, Any]
+type Receive = Callable[[], Awaitable[Message]]
+type Send = Callable[[Message], Awaitable[None]]
+type AsyncView = Callable[..., Awaitable[ResponseReturnValue]]
+
+ASYNC_VIEWS: dict[str, AsyncView] = {}
+
+
+def async_view(*endpoints: str) -> Callable[[AsyncView], AsyncView]:
+    """Serves `endpoints` with the decorated coroutine when running on ASGI, the WSGI view is used otherwise."""
+
+    def decorator(view: AsyncView) -> AsyncView:
+        for i in endpoints:
+            ASYNC_VIEWS[i] = view
+        return view
+
+    return decorator
+
+
+class AsgiApp:
+    """ASGI entry point of the Flask app.
+
+    Endpoints with an async view are awaited on the event loop, so a worker serves many pages while they wait on upstream.
+    Every other request runs the WSGI app in a thread.
+    """
+
+    def __init__(self, app: Flask) -> None:
+        self.app: Flask = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        match scope["type"]:
+            case "lifespan":
+                await self.__lifespan(receive, send)
+            case "http":
+                environ: dict[str, Any] = self.__environ(scope, await self.__body(receive))
+                if view := self.__view(environ):
+                    with self.app.request_context(environ):
+                        response: Response = await self.__dispatch(view)
+                    await self.__send(response, send)
+                else:
+                    await self.__send_wsgi(environ, send)
+            case _:
+                pass
+
+    def __view(self, environ: dict[str, Any]) -> AsyncView | None:
+        # Matched without a request context, pushing one would run the teardown handlers of the request twice.
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        return ASYNC_VIEWS.get(str(endpoint))
+
+    async def __dispatch(self, view: AsyncView) -> Response:
+        rv: ResponseReturnValue | None
+        try:
+            rv = self.app.preprocess_request()
+            if rv is None:
+                rv = await view(**(request.view_args or {}))
+        except Exception as e:
+            try:
+                rv = self.app.handle_user_exception(e)
+            except Exception as error:
+                return self.app.handle_exception(error)
+
+        return self.app.finalize_request(rv)
+
+    async def __send(self, response: Response, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in response.headers.items()],
+            }
+        )
+        # The body renders the templates and reads the caches, it is iterated in a thread.
+        context: contextvars.Context = contextvars.copy_context()
+        chunks: Iterator[bytes] = response.iter_encoded()
+        try:
+            while (chunk := await self.__thread(context, next, chunks, None)) is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await self.__thread(context, response.close)
+
+    async def __send_wsgi(self, environ: dict[str, Any], send: Send) -> None:
+        start: list[Any] = []
+
+        def start_response(status: str, headers: list[tuple[str, str]], _: object = None) -> Callable[[bytes], None]:
+            start[:] = [int(status.split(" ", 1)[0]), headers]
+            return lambda _: None
+
+        context: contextvars.Context = contextvars.copy_context()
+        body: Iterable[bytes] = await self.__thread(context, self.app, environ, start_response)
+        chunks: Iterator[bytes] = iter(body)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": start[0],
+                    "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in start[1]],
+                }
+            )
+            while (chunk := await self.__thread(context, next, chunks, None)) is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if close := getattr(body, "close", None):
+                await self.__thread(context, close)
+
+    async def __thread[**P, T](self, context: contextvars.Context, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        # Every step of a body runs in the same context, a streamed template pops the request context it pushed.
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: context.run(func, *args, **kwargs))
+
+    async def __lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            match (await receive())["type"]:
+                case "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                case "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+                case _:
+                    pass
+
+    async def __body(self, receive: Receive) -> bytes:
+        body: bytes = b""
+        while True:
+            message: Message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    def __environ(self, scope: Scope, body: bytes) -> dict[str, Any]:
+        server: tuple[str, int] = scope.get("server") or ("localhost", 80)
+        environ: dict[str, Any] = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+            "PATH_INFO": scope["path"].encode().decode("latin1"),
+            "QUERY_STRING": scope["query_string"].decode("latin1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for k, v in scope["headers"]:
+            name: str = k.decode("latin1").upper().replace("-", "_")
+            value: str = v.decode("latin1")
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[name] = value
+            elif f"HTTP_{name}" in environ:
+                environ[f"HTTP_{name}"] += f",{value}"
+            else:
+                environ[f"HTTP_{name}"] = value
+
+        return environ
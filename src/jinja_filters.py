@@ -5,6 +5,8 @@ from typing import cast
 
 from flask import current_app, request, url_for
 
+from .lib.expiry import expiry
+
 
 def format_time(timestamp: str | float) -> str:
     time: datetime = datetime.fromtimestamp(float(timestamp))
@@ -41,6 +43,10 @@ def format_number(number: int) -> str:
 
 
 def proxy(s: str) -> str:
+    # Templates also pass missing URLs, as the picture of a feed without one.
+    if s:
+        for url in re.findall(r"https?://[^/]*.fbcdn.net/[^ ]*", s):
+            expiry.count(url)
     if request.cookies.get("proxy", cast("str", current_app.config["DEFAULT_SETTINGS"]["proxy"])) != "on":
         return s
     return re.sub(r"https?://[^/]*.fbcdn.net/([^ ]*)", rf"{url_for('cdn.cdn', path='', _external=True)}\1", s)
@@ -1,6 +1,8 @@
 from collections.abc import Callable
 from typing import Any
 
+from .lib.fragments import fragments
+
 
 def types(obj: object) -> str:
     return type(obj).__name__
@@ -8,4 +10,6 @@ def types(obj: object) -> str:
 
 GLOBALS: dict[str, Callable[..., Any]] = {
     "type": types,
+    "fragment": fragments.render,
+    "preload": fragments.preload,
 }
@@ -1,10 +1,20 @@
-import inspect
-from typing import Any
+import asyncio
+import hashlib
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from typing import Any, override
 
 import httpx
 import orjson
 
-from .exceptions import ResponseError
+from .cache import MemoryCache, SQLiteCache
+from .exceptions import ResponseError, Unavailable
+from .expiry import expiry
+from .flight import flights
+from .limiter import limiter
+from .pool import pool
 
 type JSON = dict[str, Any]
 
@@ -27,9 +37,77 @@ EXTRA_VARIABLES: JSON = {
     "__relay_internal__pv__GroupsCometLazyLoadFeaturedSectionrelayprovider": False,
 }
 
+# Seconds a successful response of each query is reused, 0 disables caching for the query.
+RESPONSE_TTL: dict[str, float] = {
+    "ProfileCometHeaderQuery": 3600,
+    "ProfilePlusCometLoggedOutRootQuery": 3600,
+    "ProfileCometTimelineFeedQuery": 300,
+    "ProfileCometTimelineFeedRefetchQuery": 300,
+    "CometSinglePostDialogContentQuery": 300,
+    "CommentsListComponentsPaginationQuery": 120,
+    "CommentListComponentsRootQuery": 120,
+    "Depth1CommentsListPaginationQuery": 120,
+    "FBReelsRootWithEntrypointQuery": 600,
+    "CometGroupRootQuery": 3600,
+    "GroupsCometDiscussionLayoutRootQuery": 3600,
+    "CometGroupDiscussionRootSuccessQuery": 300,
+    "GroupsCometFeedRegularStoriesPaginationQuery": 300,
+    "CometPhotoAlbumQuery": 600,
+    "CometAlbumPhotoCollagePaginationQuery": 600,
+    "CometPhotoRootContentQuery": 600,
+    "SearchCometResultsPaginatedResultsQuery": 120,
+}
+
+# Seconds an upstream request may take, less once the deadline of the page is nearer.
+TIMEOUT: float = 15
+
+# Upstream statuses of an overloaded or rate limiting Facebook, the request is retried.
+TRANSIENT_STATUSES: frozenset[int] = frozenset((429, 500, 502, 503, 504))
+
+# Seconds a resolved route is reused, unknown routes are only remembered briefly.
+ROUTE_TTL: dict[str, float] = {
+    "found": 7 * 24 * 3600,
+    "not_found": 300,
+}
+
+responses: MemoryCache = MemoryCache()
+routes: SQLiteCache = SQLiteCache()
+
+
+class Lines:
+    """Decodes the lines of a GraphQL response as they are read.
+
+    The first line is always kept. Later lines not containing `label` are skipped before decoding. Reading stops after
+    `lines` kept lines, or after a kept line whose data has the `until` key, such as the `page_info` of a feed.
+    """
+
+    def __init__(self, label: str | None = None, until: str | None = None, lines: int | None = None) -> None:
+        self.label: str | None = label
+        self.until: str | None = until
+        self.lines: int | None = lines
+        self.result: list[JSON] = []
+        self.raw: list[str] = []
+
+    def feed(self, line: str) -> bool:
+        """Returns False once the needed lines are read."""
+        if not line or (self.result and self.label and self.label not in line):
+            return True
+        data: JSON = orjson.loads(line)
+        self.result.append(data)
+        self.raw.append(line)
+        if self.lines and len(self.result) >= self.lines:
+            return False
+        return not (self.until and len(self.result) > 1 and self.until in (data.get("data") or {}))
+
+
+class Queries[T](ABC):
+    """GraphQL queries of the Comet frontend, sent by `Api` or awaited from `AsyncApi`.
+
+    Requests are paced and retried by `limiter`, no retry starts after `deadline` and no request outlives it.
+    """
 
-class Api:
     def __init__(self) -> None:
+        self.deadline: float | None = limiter.page_deadline()
         self.LSD: str = "_"
         self.HEADERS: dict[str, str] = {
             "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:139.0) Gecko/20100101 Firefox/139.0",
@@ -45,59 +123,94 @@ class Api:
             "Sec-Fetch-Site": "same-origin",
             "TE": "trailers",
         }
-        self.__client: httpx.Client = httpx.Client(
-            headers=self.HEADERS,
-            base_url="https://www.facebook.com",
-            timeout=15,
-        )
 
-    def __fetch(self, doc_id: str, variables: JSON, *, fuck_facebook: bool = False) -> list[JSON]:
-        response: httpx.Response = self.__client.post(
-            "/api/graphql/",
-            data={
-                "__a": "1",
-                "__comet_req": "15",
-                "lsd": self.LSD,
-                "variables": orjson.dumps(variables | EXTRA_VARIABLES).decode(),
-                "doc_id": doc_id,
-            },
-        )
+    @abstractmethod
+    def _fetch(
+        self,
+        doc_id: str,
+        variables: JSON,
+        *,
+        fuck_facebook: bool = False,
+        label: str | None = None,
+        until: str | None = None,
+        lines: int | None = None,
+    ) -> T: ...
+
+    def _graphql_form(self, doc_id: str, variables: JSON) -> dict[str, str]:
+        return {
+            "__a": "1",
+            "__comet_req": "15",
+            "lsd": self.LSD,
+            "variables": orjson.dumps(variables | EXTRA_VARIABLES).decode(),
+            "doc_id": doc_id,
+        }
+
+    def _route_form(self, url: str) -> dict[str, str]:
+        return {
+            "route_url": url,
+            "__a": "1",
+            "__comet_req": "15",
+            "lsd": self.LSD,
+        }
+
+    def _cached_graphql(self, query: str, doc_id: str, variables: JSON) -> tuple[str, float, list[JSON] | None]:
+        key: str = "graphql:" + hashlib.blake2b(doc_id.encode() + orjson.dumps(variables, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        ttl: float = RESPONSE_TTL.get(query, 0)
+        if ttl and (content := responses.get(key)) is not None:
+            return key, ttl, [orjson.loads(i) for i in content.splitlines()]
+        return key, ttl, None
+
+    def _timeout(self) -> float:
+        if self.deadline is None:
+            return TIMEOUT
+        if (left := self.deadline - time.time()) <= 0:
+            raise Unavailable("Facebook took too long to answer")
+        return min(TIMEOUT, left)
+
+    def _check_status(self, response: httpx.Response) -> None:
+        if response.status_code in TRANSIENT_STATUSES:
+            raise Unavailable(f"Facebook return {response.status_code}")
+
+    def _check_graphql(self, response: httpx.Response) -> None:
+        self._check_status(response)
         if response.status_code != 200:
             raise ResponseError(f"Facebook return {response.status_code}")
-        result: list[JSON] = [orjson.loads(i) for i in response.text.splitlines()]
-        if (errors := result[0].get("errors")) and not (
-            fuck_facebook and "A server error field_exception occured." in errors[0]["message"]
-        ):
-            raise ResponseError(f"{inspect.stack()[1].function}: " + ", ".join(i["message"] for i in errors))
 
-        return result
+    def _parse_graphql(self, query: str, key: str, ttl: float, lines: Lines, *, fuck_facebook: bool) -> list[JSON]:
+        if not lines.result:
+            raise ResponseError(f"{query}: empty response")
+        if errors := lines.result[0].get("errors"):
+            if not (fuck_facebook and "A server error field_exception occured." in errors[0]["message"]):
+                raise ResponseError(f"{query}: " + ", ".join(i["message"] for i in errors))
+        elif ttl:
+            # Only the kept lines are cached, the same lines are kept for every response of a query.
+            content: bytes = "\n".join(lines.raw).encode()
+            responses.set(key, content, expiry.ttl(content, ttl))
 
-    def route(self, url: str, *, redirect: bool = False) -> tuple[JSON | None, str | None]:
-        response: httpx.Response = self.__client.post(
-            "/ajax/navigation/",
-            data={
-                "route_url": url,
-                "__a": "1",
-                "__comet_req": "15",
-                "lsd": self.LSD,
-            },
-        )
-        result: JSON = orjson.loads(response.text[9:])["payload"].get("payload", {}).get("result", {})
-        if not result:
-            return None, None
-        if result["type"] == "route_redirect":
-            if redirect:
-                result = result["redirect_result"]
-            else:
-                return None, None
+        return lines.result
+
+    def _cached_route(self, url: str, *, redirect: bool) -> tuple[str, tuple[JSON | None, str | None] | None]:
+        key: str = f"route:{int(redirect)}:{url}"
+        if (cached := routes.get(key)) is None:
+            return key, None
+        exports, entity_type = orjson.loads(cached)
+        return key, (exports, entity_type)
 
-        return result["exports"], result["exports"]["entityKeyConfig"]["entity_type"]["value"]
+    def _parse_route(self, key: str, response: httpx.Response, *, redirect: bool) -> tuple[JSON | None, str | None]:
+        exports: JSON | None = None
+        entity_type: str | None = None
+        result: JSON = orjson.loads(response.text[9:])["payload"].get("payload", {}).get("result", {})
+        if result and result["type"] == "route_redirect":
+            result = result["redirect_result"] if redirect else {}
+        if result:
+            exports = result["exports"]
+            entity_type = result["exports"]["entityKeyConfig"]["entity_type"]["value"]
+        routes.set(key, orjson.dumps([exports, entity_type]), ROUTE_TTL["found" if exports else "not_found"])
 
-    def close(self) -> None:
-        self.__client.close()
+        return exports, entity_type
 
-    def ProfileCometHeaderQuery(self, user_id: str) -> list[JSON]:
-        return self.__fetch(
+    def ProfileCometHeaderQuery(self, user_id: str) -> T:
+        return self._fetch(
             "24637479539185522",
             {
                 "scale": 1,
@@ -106,10 +219,11 @@ class Api:
                 "shouldUseFXIMProfilePicEditor": False,
                 "userID": user_id,
             },
+            lines=1,
         )
 
-    def ProfilePlusCometLoggedOutRootQuery(self, user_id: str) -> list[JSON]:
-        return self.__fetch(
+    def ProfilePlusCometLoggedOutRootQuery(self, user_id: str) -> T:
+        return self._fetch(
             "29764188139896558",
             {
                 "scale": 1,
@@ -117,8 +231,8 @@ class Api:
             },
         )
 
-    def ProfileCometTimelineFeedQuery(self, user_id: str) -> list[JSON]:
-        return self.__fetch(
+    def ProfileCometTimelineFeedQuery(self, user_id: str) -> T:
+        return self._fetch(
             "24130362143235169",
             {
                 "count": 1,
@@ -131,15 +245,17 @@ class Api:
                 "stream_count": 1,
                 "userID": user_id,
             },
+            label="page_info",
+            until="page_info",
         )
 
-    def ProfileCometTimelineFeedRefetchQuery(self, user_id: str, cursor: str | None) -> list[JSON]:
-        return self.__fetch(
+    def ProfileCometTimelineFeedRefetchQuery(self, user_id: str, cursor: str | None, count: int = 3) -> T:
+        return self._fetch(
             "29857242777255325",
             {
                 "afterTime": None,
                 "beforeTime": None,
-                "count": 3,
+                "count": count,
                 "cursor": cursor,
                 "feedLocation": "TIMELINE",
                 "feedbackSource": 0,
@@ -157,10 +273,12 @@ class Api:
                 "useDefaultActor": False,
                 "id": user_id,
             },
+            label="ProfileCometTimelineFeed_user",
+            until="page_info",
         )
 
-    def CometSinglePostDialogContentQuery(self, story_id: str, focus_id: str | None = None) -> list[JSON]:
-        return self.__fetch(
+    def CometSinglePostDialogContentQuery(self, story_id: str, focus_id: str | None = None) -> T:
+        return self._fetch(
             "30329081383349461",
             {
                 "feedbackSource": 2,
@@ -172,10 +290,11 @@ class Api:
                 "storyID": story_id,
                 "useDefaultActor": False,
             },
+            lines=1,
         )
 
-    def CommentsListComponentsPaginationQuery(self, feedback_id: str, cursor: str | None) -> list[JSON]:
-        return self.__fetch(
+    def CommentsListComponentsPaginationQuery(self, feedback_id: str, cursor: str | None) -> T:
+        return self._fetch(
             "24152478804356082",
             {
                 "commentsAfterCount": -1,
@@ -189,10 +308,11 @@ class Api:
                 "useDefaultActor": False,
                 "id": feedback_id,
             },
+            lines=1,
         )
 
-    def CommentListComponentsRootQuery(self, feedback_id: str, sort: str, focus_id: str | None = None) -> list[JSON]:
-        return self.__fetch(
+    def CommentListComponentsRootQuery(self, feedback_id: str, sort: str, focus_id: str | None = None) -> T:
+        return self._fetch(
             "9884198138336503",
             {
                 "commentsIntentToken": sort,
@@ -203,10 +323,11 @@ class Api:
                 "useDefaultActor": False,
                 "id": feedback_id,
             },
+            lines=1,
         )
 
-    def Depth1CommentsListPaginationQuery(self, feedback_id: str, expansion_token: str, cursor: str | None) -> list[JSON]:
-        return self.__fetch(
+    def Depth1CommentsListPaginationQuery(self, feedback_id: str, expansion_token: str, cursor: str | None) -> T:
+        return self._fetch(
             "24355745037360129",
             {
                 "clientKey": None,
@@ -221,10 +342,11 @@ class Api:
                 "useDefaultActor": False,
                 "id": feedback_id,
             },
+            lines=1,
         )
 
-    def FBReelsRootWithEntrypointQuery(self, reel_id: str) -> list[JSON]:
-        return self.__fetch(
+    def FBReelsRootWithEntrypointQuery(self, reel_id: str) -> T:
+        return self._fetch(
             "30094271533520445",
             {
                 "count": 0,
@@ -242,10 +364,11 @@ class Api:
                 "surface_type": "FEED_VIDEO_DEEP_DIVE",
                 "useDefaultActor": False,
             },
+            lines=1,
         )
 
-    def CometGroupRootQuery(self, group_id: str) -> list[JSON]:
-        return self.__fetch(
+    def CometGroupRootQuery(self, group_id: str) -> T:
+        return self._fetch(
             "24726713260250827",
             {
                 "groupID": group_id,
@@ -253,10 +376,11 @@ class Api:
                 "isChainingRecommendationUnit": False,
                 "scale": 1,
             },
+            lines=1,
         )
 
-    def GroupsCometDiscussionLayoutRootQuery(self, group_id: str) -> list[JSON]:
-        return self.__fetch(
+    def GroupsCometDiscussionLayoutRootQuery(self, group_id: str) -> T:
+        return self._fetch(
             "29803864032592554",
             {
                 "groupID": group_id,
@@ -264,8 +388,8 @@ class Api:
             },
         )
 
-    def CometGroupDiscussionRootSuccessQuery(self, group_id: str) -> list[JSON]:
-        return self.__fetch(
+    def CometGroupDiscussionRootSuccessQuery(self, group_id: str) -> T:
+        return self._fetch(
             "23997107266592174",
             {
                 "autoOpenChat": False,
@@ -290,13 +414,14 @@ class Api:
                 "useDefaultActor": False,
             },
             fuck_facebook=True,
+            until="page_info",
         )
 
-    def GroupsCometFeedRegularStoriesPaginationQuery(self, group_id: str, cursor: str | None) -> list[JSON]:
-        return self.__fetch(
+    def GroupsCometFeedRegularStoriesPaginationQuery(self, group_id: str, cursor: str | None, count: int = 3) -> T:
+        return self._fetch(
             "9755367644572581",
             {
-                "count": 3,
+                "count": count,
                 "cursor": cursor,
                 "feedLocation": "GROUP",
                 "feedType": "DISCUSSION",
@@ -310,10 +435,12 @@ class Api:
                 "useDefaultActor": False,
                 "id": group_id,
             },
+            label="GroupsCometFeedRegularStories_group_group_feed",
+            until="page_info",
         )
 
-    def CometPhotoAlbumQuery(self, token: str) -> list[JSON]:
-        return self.__fetch(
+    def CometPhotoAlbumQuery(self, token: str) -> T:
+        return self._fetch(
             "29989561257355685",
             {
                 "feedbackSource": 65,
@@ -325,22 +452,24 @@ class Api:
                 "scale": 1,
                 "useDefaultActor": False,
             },
+            lines=1,
         )
 
-    def CometAlbumPhotoCollagePaginationQuery(self, album_id: str, cursor: str | None) -> list[JSON]:
-        return self.__fetch(
+    def CometAlbumPhotoCollagePaginationQuery(self, album_id: str, cursor: str | None, count: int = 14) -> T:
+        return self._fetch(
             "9782410388506700",
             {
-                "count": 14,
+                "count": count,
                 "cursor": cursor,
                 "renderLocation": "permalink",
                 "scale": 1,
                 "id": album_id,
             },
+            lines=1,
         )
 
-    def CometPhotoRootContentQuery(self, node_id: str) -> list[JSON]:
-        return self.__fetch(
+    def CometPhotoRootContentQuery(self, node_id: str) -> T:
+        return self._fetch(
             "23916701474613206",
             {
                 "feedbackSource": 65,
@@ -354,6 +483,7 @@ class Api:
                 "nodeID": node_id,
                 "focusCommentID": None,
             },
+            lines=1,
         )
 
     def SearchCometResultsPaginatedResultsQuery(
@@ -362,8 +492,9 @@ class Api:
         category: str,
         cursor: str | None,
         filters: list[str] | None = None,
-    ) -> list[JSON]:
-        return self.__fetch(
+        count: int = 5,
+    ) -> T:
+        return self._fetch(
             "23897855153159069",
             {
                 "allow_streaming": False,
@@ -386,7 +517,7 @@ class Api:
                     "filters": filters or [],
                     "text": query,
                 },
-                "count": 5,
+                "count": count,
                 "cursor": cursor,
                 "feedLocation": "SEARCH",
                 "feedbackSource": 23,
@@ -399,4 +530,137 @@ class Api:
                 "stream_initial_count": 0,
                 "useDefaultActor": False,
             },
+            lines=1,
         )
+
+
+class Api(Queries[list[JSON]]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.__client: httpx.Client = pool.client(
+            "https://www.facebook.com",
+            headers=self.HEADERS,
+            timeout=TIMEOUT,
+        )
+
+    @override
+    def _fetch(
+        self,
+        doc_id: str,
+        variables: JSON,
+        *,
+        fuck_facebook: bool = False,
+        label: str | None = None,
+        until: str | None = None,
+        lines: int | None = None,
+    ) -> list[JSON]:
+        query: str = sys._getframe(1).f_code.co_name  # noqa: SLF001  # pyright: ignore[reportPrivateUsage]
+        key, ttl, cached = self._cached_graphql(query, doc_id, variables)
+        if cached is not None:
+            return cached
+
+        def fetch() -> list[JSON]:
+            # Each attempt decodes the lines of its own response.
+            return self.__post(query, key, ttl, doc_id, variables, Lines(label, until, lines), fuck_facebook=fuck_facebook)
+
+        return flights.run(key, lambda: limiter.call(fetch, self.deadline))
+
+    def __post(
+        self, query: str, key: str, ttl: float, doc_id: str, variables: JSON, parsed: Lines, *, fuck_facebook: bool
+    ) -> list[JSON]:
+        with self.__client.stream(
+            "POST", "/api/graphql/", data=self._graphql_form(doc_id, variables), timeout=self._timeout()
+        ) as response:
+            self._check_graphql(response)
+            rest: Iterator[str] = response.iter_lines()
+            for line in rest:
+                if not parsed.feed(line):
+                    break
+            # The remaining lines are read but not decoded, so the connection goes back to the pool.
+            for _ in rest:
+                pass
+
+        return self._parse_graphql(query, key, ttl, parsed, fuck_facebook=fuck_facebook)
+
+    def route(self, url: str, *, redirect: bool = False) -> tuple[JSON | None, str | None]:
+        key, cached = self._cached_route(url, redirect=redirect)
+        if cached:
+            return cached
+
+        def fetch() -> tuple[JSON | None, str | None]:
+            response: httpx.Response = self.__client.post("/ajax/navigation/", data=self._route_form(url), timeout=self._timeout())
+            self._check_status(response)
+            return self._parse_route(key, response, redirect=redirect)
+
+        exports, entity_type = flights.run(key, lambda: limiter.call(fetch, self.deadline))
+        return exports, entity_type
+
+
+class AsyncApi(Queries[Awaitable[list[JSON]]]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.__client: httpx.AsyncClient = pool.async_client(
+            "https://www.facebook.com",
+            headers=self.HEADERS,
+            timeout=TIMEOUT,
+        )
+
+    @override
+    def _fetch(
+        self,
+        doc_id: str,
+        variables: JSON,
+        *,
+        fuck_facebook: bool = False,
+        label: str | None = None,
+        until: str | None = None,
+        lines: int | None = None,
+    ) -> Awaitable[list[JSON]]:
+        # The query name is taken here, the frame of the query method is gone once the coroutine runs.
+        query: str = sys._getframe(1).f_code.co_name  # noqa: SLF001  # pyright: ignore[reportPrivateUsage]
+        return self.__fetch(query, doc_id, variables, lambda: Lines(label, until, lines), fuck_facebook=fuck_facebook)
+
+    async def __fetch(
+        self, query: str, doc_id: str, variables: JSON, lines: Callable[[], Lines], *, fuck_facebook: bool
+    ) -> list[JSON]:
+        # The caches may be kept in a file or on another server, they are read and written off the event loop.
+        key, ttl, cached = await asyncio.to_thread(self._cached_graphql, query, doc_id, variables)
+        if cached is not None:
+            return cached
+
+        def fetch() -> Awaitable[list[JSON]]:
+            # Each attempt decodes the lines of its own response.
+            return self.__post(query, key, ttl, doc_id, variables, lines(), fuck_facebook=fuck_facebook)
+
+        return await flights.arun(key, lambda: limiter.acall(fetch, self.deadline))
+
+    async def __post(
+        self, query: str, key: str, ttl: float, doc_id: str, variables: JSON, parsed: Lines, *, fuck_facebook: bool
+    ) -> list[JSON]:
+        async with self.__client.stream(
+            "POST", "/api/graphql/", data=self._graphql_form(doc_id, variables), timeout=self._timeout()
+        ) as response:
+            self._check_graphql(response)
+            rest: AsyncIterator[str] = response.aiter_lines()
+            async for line in rest:
+                if not parsed.feed(line):
+                    break
+            async for _ in rest:
+                pass
+
+        return await asyncio.to_thread(self._parse_graphql, query, key, ttl, parsed, fuck_facebook=fuck_facebook)
+
+    async def route(self, url: str, *, redirect: bool = False) -> tuple[JSON | None, str | None]:
+        key, cached = await asyncio.to_thread(self._cached_route, url, redirect=redirect)
+        if cached:
+            return cached
+
+        async def fetch() -> tuple[JSON | None, str | None]:
+            response: httpx.Response = await self.__client.post(
+                "/ajax/navigation/", data=self._route_form(url), timeout=self._timeout()
+            )
+            self._check_status(response)
+            return await asyncio.to_thread(self._parse_route, key, response, redirect=redirect)
+
+        exports, entity_type = await flights.arun(key, lambda: limiter.acall(fetch, self.deadline))
+        return exports, entity_type
@@ -0,0 +1,261 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import override
+
+# Triggers keep the total size of the values in `cache_size`, its row is created from the entries of older databases.
+SCHEMA: str = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL, vacuumed REAL NOT NULL);
+INSERT OR IGNORE INTO cache_size SELECT 0, coalesce(sum(length(value)), 0), 0 FROM cache;
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_size SET size = size + length(new.value);
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE ON cache BEGIN
+    UPDATE cache_size SET size = size + length(new.value) - length(old.value);
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_size SET size = size - length(old.value);
+END;
+COMMIT;
+"""
+
+
+class Cache(ABC):
+    """Cache of byte strings with a TTL per entry and a cap on the size of an entry.
+
+    Entries are kept by the backend of the subclass until `share` points the cache to a store used by every worker,
+    the caches of the app then share that store and its size limit. A disabled cache with `max_bytes` 0 stays disabled.
+    `get_many` reads several entries at once, in a single round trip on the backends that support it.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.__store: Cache | None = None
+
+    def share(self, store: "Cache | None") -> None:
+        self.__store = store
+
+    def get(self, key: str) -> bytes | None:
+        value: bytes | None = None
+        if self.max_bytes:
+            value = self.__store.get(key) if self.__store else self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        values: list[bytes | None] = [None] * len(keys)
+        if self.max_bytes and keys:
+            values = self.__store.get_many(keys) if self.__store else self._get_many(keys)
+        found: int = len(keys) - values.count(None)
+        self.hits += found
+        self.misses += len(keys) - found
+        return values
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if ttl <= 0 or len(value) > self.max_bytes:
+            return
+        if self.__store:
+            self.__store.set(key, value, ttl)
+        else:
+            self._set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        if self.__store:
+            self.__store.delete(key)
+        else:
+            self._delete(key)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **(self.__store.stats() if self.__store else self._stats()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @abstractmethod
+    def _get(self, key: str) -> bytes | None: ...
+
+    def _get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self._get(i) for i in keys]
+
+    @abstractmethod
+    def _set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    @abstractmethod
+    def _delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def _stats(self) -> dict[str, int]: ...
+
+
+class MemoryCache(Cache):
+    """Thread-safe LRU cache of byte strings with a TTL per entry and a cap on the total size."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        super().__init__(max_bytes)
+        self.size: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def configure(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        with self.__lock:
+            self.max_bytes: int = max_bytes
+            self.__evict()
+
+    @override
+    def _get(self, key: str) -> bytes | None:
+        with self.__lock:
+            entry: tuple[float, bytes] | None = self.__entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self.__remove(key)
+                return None
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+    @override
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (time.time() + ttl, value)
+            self.size += len(value)
+            self.__evict()
+
+    @override
+    def _delete(self, key: str) -> None:
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+
+    @override
+    def _stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.__entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def __remove(self, key: str) -> None:
+        self.size -= len(self.__entries.pop(key)[1])
+
+    def __evict(self) -> None:
+        while self.size > self.max_bytes:
+            self.size -= len(self.__entries.popitem(last=False)[1][1])
+
+
+class SQLiteCache(Cache):
+    """Persistent cache of byte strings in an SQLite database, shared by every worker that opens the same file.
+
+    Once the total size of the values in the database exceeds `max_bytes` the expired entries and
+    then those closest to expiring are deleted. Every `vacuum_interval` seconds a single worker returns the freed pages
+    to the file system and truncates the write-ahead log.
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int = 1024 * 1024 * 1024, vacuum_interval: float = 3600) -> None:
+        super().__init__(max_bytes)
+        self.path: str | None = path
+        self.vacuum_interval: float = vacuum_interval
+        self.__writes: int = 0
+        self.__local: threading.local = threading.local()
+
+    def configure(self, path: str | None = None, max_bytes: int = 1024 * 1024 * 1024, vacuum_interval: float = 3600) -> None:
+        self.path = path
+        self.max_bytes: int = max_bytes
+        self.vacuum_interval = vacuum_interval
+        self.__local = threading.local()
+
+    def vacuum(self) -> None:
+        """Deletes the expired entries, returns the free pages of the database file and truncates the write-ahead log."""
+        if not self.path:
+            return
+        connection: sqlite3.Connection = self.__connection()
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Databases created before incremental vacuum was enabled are converted once.
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("VACUUM")
+        else:
+            connection.execute("PRAGMA incremental_vacuum").fetchall()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    @override
+    def _get(self, key: str) -> bytes | None:
+        if not self.path:
+            return None
+        row: tuple[bytes] | None = (
+            self.__connection().execute("SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        )
+        return row[0] if row else None
+
+    @override
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        if not self.path:
+            return
+        connection: sqlite3.Connection = self.__connection()
+        connection.execute(
+            "INSERT INTO cache VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (key, value, time.time() + ttl),
+        )
+        self.__writes += 1
+        if self.__writes % 100 == 0:
+            self.__maintain(connection)
+
+    @override
+    def _delete(self, key: str) -> None:
+        if self.path:
+            self.__connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    @override
+    def _stats(self) -> dict[str, int]:
+        entries: int = 0
+        size: int = 0
+        if self.path:
+            connection: sqlite3.Connection = self.__connection()
+            entries = connection.execute("SELECT count(*) FROM cache").fetchone()[0]
+            size = connection.execute("SELECT size FROM cache_size").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def __maintain(self, connection: sqlite3.Connection) -> None:
+        now: float = time.time()
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        # Evicts down to 90% of the limit, a full cache would otherwise evict on every maintenance.
+        while connection.execute("SELECT size FROM cache_size").fetchone()[0] > self.max_bytes * 0.9:
+            connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT 100)")
+        # The worker that moves the timestamp forward runs the vacuum, the others skip it.
+        if connection.execute("UPDATE cache_size SET vacuumed = ? WHERE vacuumed < ?", (now, now - self.vacuum_interval)).rowcount:
+            self.vacuum()
+
+    def __connection(self) -> sqlite3.Connection:
+        # One connection per thread and process, connections must not cross a fork.
+        connection: sqlite3.Connection | None = getattr(self.__local, "connection", None)
+        if connection is None or self.__local.pid != os.getpid():
+            path: str = str(self.path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+            # Only applies to a new database, older ones are converted by the first vacuum.
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return connection
+
+
+store: SQLiteCache = SQLiteCache()
@@ -0,0 +1,54 @@
+import re
+import time
+
+OE: re.Pattern[str] = re.compile(r"(?:[?&]|\\u0026|&amp;)oe=([0-9A-Fa-f]{8})(?![0-9A-Fa-f])")
+OE_BYTES: re.Pattern[bytes] = re.compile(OE.pattern.encode())
+
+
+class Expiry:
+    """Signature expiry of fbcdn URLs, the `oe` query parameter is the Unix time they stop working at in hex.
+
+    Anything holding such URLs is cached until `margin` seconds before the earliest of them expires, and rendered URLs
+    closer than `margin` to their expiry are counted.
+    """
+
+    def __init__(self, margin: float = 600) -> None:
+        self.margin: float = margin
+        self.rendered: int = 0
+        self.expiring: int = 0
+
+    def configure(self, margin: float = 600) -> None:
+        self.margin = margin
+
+    def of(self, s: str | bytes) -> float | None:
+        matches: list[str] | list[bytes] = OE.findall(s) if isinstance(s, str) else OE_BYTES.findall(s)
+        return min((int(i, 16) for i in matches), default=None)
+
+    def ttl(self, s: str | bytes, ttl: float) -> float:
+        expires: float | None = self.of(s)
+        if expires is None:
+            return ttl
+        return min(ttl, expires - self.margin - time.time())
+
+    def count(self, url: str) -> None:
+        expires: float | None = self.of(url)
+        self.rendered += 1
+        if expires is not None and expires - self.margin < time.time():
+            self.expiring += 1
+
+    def count_cached(self, html: bytes) -> None:
+        """Counts the URLs of HTML rendered earlier, found by their expiry, URLs without one are not counted."""
+        now: float = time.time()
+        for i in OE_BYTES.findall(html):
+            self.rendered += 1
+            if int(i, 16) - self.margin < now:
+                self.expiring += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "rendered": self.rendered,
+            "expiring": self.expiring,
+        }
+
+
+expiry: Expiry = Expiry()
@@ -1,28 +1,347 @@
+import asyncio
+import time
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import wait
 from contextlib import suppress
+from typing import TYPE_CHECKING, Any, Self, override
 from urllib.parse import parse_qs, urlparse
 
-from .api import JSON, Api
+from .api import JSON, Api, AsyncApi
+from .cache import MemoryCache
 from .exceptions import InvalidResponse, NotFound
-from .parsers import Comment, Feed, Photo, Post, User, Video, parse_comment, parse_post
+from .expiry import expiry
+from .paging import SIZE, sizes
+from .parsers import Comment, Feed, Photo, Post, User, Video, dump, load, parse_comment, parse_post
+from .pool import pool
 from .utils import base64s, base64s_decode, urlbasename
 
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
 
-class GetProfile:
-    def __init__(self, username: str, start_cursor: str | None) -> None:
+
+class Call:
+    """An upstream request made by an extractor, `Call("route", url)` runs `api.route(url)`."""
+
+    def __init__(self, method: str, *args: object, **kwargs: object) -> None:
+        self.method: str = method
+        self.args: tuple[object, ...] = args
+        self.kwargs: dict[str, object] = kwargs
+
+
+class Gather:
+    """Concurrent upstream requests the page does without, each sends back None when it failed or is still running
+    `timeout` seconds after they were made.
+    """
+
+    def __init__(self, calls: list[Call], timeout: float) -> None:
+        self.calls: list[Call] = calls
+        self.timeout: float = timeout
+
+
+# Extractors are generators of calls, the result of each call is sent back into the generator.
+# A tuple of calls is run concurrently and sends back a tuple of results, as does a `Gather`.
+# An empty tuple marks the end of a page, the items gathered so far can be rendered.
+type Steps = Generator[Call | tuple[Call, ...] | Gather, Any]
+
+# Seconds the parsed result of each extractor page is reused, 0 disables caching for the page.
+PARSED_TTL: dict[str, float] = {
+    "feed": 3600,
+    "profile": 300,
+    "post": 300,
+    "permalink": 86400,
+    "comments": 120,
+    "group": 300,
+    "album": 600,
+    "search": 120,
+}
+
+# Upstream pagination of a page view, no next upstream page is fetched once `budget` seconds have passed since the
+# view started. The items gathered so far are then shown with the cursor of the next page.
+PAGINATION: dict[str, float] = {
+    "budget": 5,
+}
+
+# Replies shown under the comments of a post with the replies setting on: the first page of replies of at most
+# `comments` comments is fetched concurrently, the replies still missing after `timeout` seconds are left out.
+REPLIES: dict[str, float] = {
+    "comments": 5,
+    "timeout": 3,
+}
+
+parsed: MemoryCache = MemoryCache()
+
+
+class Extractor:
+    partial: bool = False
+    started: float = 0
+    _paging: bool = False
+
+    def _run(self, steps: Steps) -> None:
+        api: Api = Api()
+        result: Any = None
+        self.started = time.time()
+        while True:
+            try:
+                step: Call | tuple[Call, ...] | Gather = steps.send(result)
+            except StopIteration:
+                return
+            try:
+                result = self._call(api, step)
+            except Exception:
+                if not self._stop(steps):
+                    raise
+                return
+            self._paging = False
+
+    def _call(self, api: Api, step: Call | tuple[Call, ...] | Gather) -> Any:  # noqa: ANN401
+        if isinstance(step, Call):
+            return getattr(api, step.method)(*step.args, **step.kwargs)
+        executor: Executor = pool.executor()
+        calls: Iterable[Call] = step.calls if isinstance(step, Gather) else step
+        futures: list[Future[Any]] = [executor.submit(getattr(api, i.method), *i.args, **i.kwargs) for i in calls]
+        if not isinstance(step, Gather):
+            return tuple(i.result() for i in futures)
+        done, pending = wait(futures, step.timeout)
+        for i in pending:
+            i.cancel()
+        return tuple(i.result() if i in done and i.exception() is None else None for i in futures)
+
+    def _pages(self, count: int, *, first: bool = False) -> Iterator[int]:
+        """Counts up to `count` next upstream pages, fewer with `partial` set once the pagination budget is spent.
+
+        With `first`, the first page counted is the first page of the view, it is always fetched and may not fail.
+        """
+        for i in range(count):
+            if first and not i:
+                yield i
+                continue
+            if time.time() - self.started > PAGINATION["budget"]:
+                self.partial = True
+                return
+            self._paging = True
+            yield i
+
+    def _stop(self, steps: Steps) -> bool:
+        """Ends `steps` when the request of a next upstream page failed, the earlier pages are kept with its cursor."""
+        if not self._paging:
+            return False
+        self.partial = True
+        steps.close()
+        return True
+
+    def _cached(self, kind: str, *key: object) -> Any:  # noqa: ANN401
+        data: bytes | None = parsed.get(":".join((kind, *map(str, key))))
+        return None if data is None else load(data)
+
+    def _cache(self, value: object, kind: str, *key: object) -> None:
+        if ttl := PARSED_TTL.get(kind, 0):
+            data: bytes = dump(value)
+            parsed.set(":".join((kind, *map(str, key))), data, expiry.ttl(data, ttl))
+
+    def _index(self, posts: Iterable[object]) -> None:
+        """Caches each post of a page by id, with the id its permalink tokens lead to.
+
+        A permalink opened from a timeline then needs neither the route lookup nor the post query, only the comments.
+        """
+        for i in posts:
+            post: object = i
+            while isinstance(post, Post):
+                self._cache(post, "post", post.id)
+                owners: set[str | None] = {post.author.id, post.author.username}
+                if post.from_group:
+                    owners |= {post.from_group.id, post.from_group.username}
+                for owner in owners - {None}:
+                    self._cache(post.id, "permalink", owner, post.post_id)
+                post = post.shared_post
+
+    def stream[T](self, items: list[T], then: Callable[[], None] | None = None) -> Iterator[T]:
+        """Iterates over `items` and calls `then` once they are all iterated."""
+        for batch in self.batches(items, then):
+            yield from batch
+
+    def batches[T](self, items: list[T], then: Callable[[], None] | None = None) -> Iterator[list[T]]:
+        """Like `stream`, but yields the items gathered from each upstream page together."""
+        yield items
+        if then:
+            then()
+
+
+class StreamExtractor(Extractor):
+    """Runs the steps of an extractor up to its first page, `stream` fetches the next pages while the items are iterated.
+
+    The page starts rendering after the first upstream page instead of the last one. A failed next page ends the stream
+    and sets `partial`, `cursor` and `has_next` still point to it.
+    """
+
+    # Pages left to fetch, set by `_run`.
+    __pages: Iterator[None] = iter(())
+
+    @override
+    def _run(self, steps: Steps) -> None:
+        self.__pages = self.__paginate(steps)
+        self.partial: bool = False
+        next(self.__pages, None)
+
+    @override
+    def batches[T](self, items: list[T], then: Callable[[], None] | None = None) -> Iterator[list[T]]:
+        i: int = 0
+        while True:
+            yield items[i:]
+            i = len(items)
+            try:
+                next(self.__pages)
+            except StopIteration:
+                break
+            except Exception:
+                # The response has started, the items gathered so far are all that can be sent.
+                self.partial = True
+                break
+        # The last page ends the steps instead of yielding, its items are gathered all the same.
+        if len(items) > i:
+            yield items[i:]
+        if then:
+            then()
+
+    def __paginate(self, steps: Steps) -> Iterator[None]:
         api: Api = Api()
-        route, route_type = api.route(f"/{username}", redirect=True)
+        result: Any = None
+        self.started: float = time.time()
+        while True:
+            try:
+                step: Call | tuple[Call, ...] | Gather = steps.send(result)
+            except StopIteration:
+                return
+            try:
+                result = self._call(api, step)
+            except Exception:
+                if not self._stop(steps):
+                    raise
+                return
+            self._paging: bool = False
+            if step == ():
+                yield
+
+
+class AsyncExtractor(Extractor):
+    """Runs the steps of an extractor on `AsyncApi` once awaited: `profile = await AsyncGetProfile(username, cursor)`."""
+
+    # Steps to run once awaited, set by `_run`.
+    __steps: Steps | None = None
+
+    @override
+    def _run(self, steps: Steps) -> None:
+        self.__steps = steps
+
+    def __await__(self) -> Generator[Any, None, Self]:
+        return self.__run().__await__()
+
+    async def __run(self) -> Self:
+        if (steps := self.__steps) is None:
+            return self
+        api: AsyncApi = AsyncApi()
+        result: Any = None
+        self.started: float = time.time()
+        while True:
+            # The steps read and write the parsed caches, which may be kept in a file or on another server.
+            if (step := await asyncio.to_thread(self.__send, steps, result)) is None:
+                return self
+            try:
+                if isinstance(step, Call):
+                    result = await getattr(api, step.method)(*step.args, **step.kwargs)
+                elif isinstance(step, Gather):
+                    result = await self.__gather(api, step)
+                else:
+                    result = tuple(await asyncio.gather(*(getattr(api, i.method)(*i.args, **i.kwargs) for i in step)))
+            except Exception:
+                if not self._stop(steps):
+                    raise
+                return self
+            self._paging: bool = False
+
+    def __send(self, steps: Steps, result: object) -> Call | tuple[Call, ...] | Gather | None:
+        # StopIteration cannot be set on a future, the end of the steps is returned as None.
+        try:
+            return steps.send(result)
+        except StopIteration:
+            return None
+
+    async def __gather(self, api: AsyncApi, step: Gather) -> tuple[Any, ...]:
+        tasks: list[asyncio.Task[Any]] = [asyncio.ensure_future(getattr(api, i.method)(*i.args, **i.kwargs)) for i in step.calls]
+        done, pending = await asyncio.wait(tasks, timeout=step.timeout)
+        for i in pending:
+            i.cancel()
+        # A task cancelled otherwise, as through a shared flight, is missing like one still pending.
+        return tuple(i.result() if i in done and not i.cancelled() and i.exception() is None else None for i in tasks)
+
+
+class GetProfile(Extractor):
+    def __init__(self, username: str, start_cursor: str | None) -> None:
+        self.cursor: str | None = start_cursor
+        self.has_next: bool = bool(start_cursor)
+        self.posts: list[Post] = []
+        self.feed: Feed
+        self._run(self.__steps(username))
+
+    def __steps(self, username: str) -> Steps:
+        start: str | None = self.cursor
+        route, route_type = yield Call("route", f"/{username}", redirect=True)
         if not route or route_type != "profile":
             raise NotFound
         user_id: str = route["rootView"]["props"]["userID"]
-        header: JSON = api.ProfileCometHeaderQuery(user_id)[0]["data"]["user"]["profile_header_renderer"]["user"]
-        side: JSON = api.ProfilePlusCometLoggedOutRootQuery(user_id)[-1]["data"]["profile_tile_sections"]["edges"][0]["node"]
-        posts_feed: list[JSON] = api.ProfileCometTimelineFeedQuery(user_id)
+        if cached := self._cached("profile", user_id, start):
+            self.feed, self.posts, self.cursor, self.has_next = cached
+            return
+        # The header changes rarely and is cached longer than the posts, a cursor page then only fetches posts.
+        posts_feed: list[JSON] = []
+        feed: Feed | None = self._cached("feed", user_id)
+        if feed is None:
+            header_response, side_response, posts_feed = yield (
+                Call("ProfileCometHeaderQuery", user_id),
+                Call("ProfilePlusCometLoggedOutRootQuery", user_id),
+                Call("ProfileCometTimelineFeedQuery", user_id),
+            )
+            feed = self.__feed(user_id, header_response, side_response, posts_feed)
+            self._cache(feed, "feed", user_id)
+        elif not self.cursor:
+            posts_feed = yield Call("ProfileCometTimelineFeedQuery", user_id)
+        self.feed = feed
+
+        if not self.cursor:
+            if i := posts_feed[0]["data"]["user"]["timeline_list_feed_units"]["edges"]:
+                self.posts.append(parse_post(i[0]["node"]))
+            for i in posts_feed[1:]:
+                if page_info := i["data"].get("page_info"):
+                    self.cursor = page_info["end_cursor"]
+                    self.has_next = page_info["has_next_page"]
+                    break
+            else:
+                raise InvalidResponse
+        if self.has_next:
+            for _ in self._pages(3, first=bool(start)):
+                count: int = sizes.count("ProfileCometTimelineFeedRefetchQuery", SIZE["profile"] - len(self.posts))
+                response: list[JSON] = yield Call("ProfileCometTimelineFeedRefetchQuery", user_id, self.cursor, count)
+                rest: list[JSON] = [i for i in response[1:] if "ProfileCometTimelineFeed_user" in i.get("label", "")]
+
+                before: int = len(self.posts)
+                if edges := response[0]["data"]["node"]["timeline_list_feed_units"]["edges"]:
+                    self.posts.append(parse_post(edges[0]["node"]))
+                self.posts.extend(parse_post(i["data"]["node"]) for i in rest[:-1])
+                self.cursor = rest[-1]["data"]["page_info"]["end_cursor"]
+                self.has_next = rest[-1]["data"]["page_info"]["has_next_page"]
+                sizes.observe("ProfileCometTimelineFeedRefetchQuery", count, len(self.posts) - before, has_next=self.has_next)
+                if not self.has_next or len(self.posts) >= SIZE["profile"]:
+                    break
+                yield ()
+        self._index(self.posts)
+        if not self.partial:
+            self._cache([self.feed, self.posts, self.cursor, self.has_next], "profile", user_id, start)
+
+    def __feed(self, user_id: str, header_response: list[JSON], side_response: list[JSON], posts_feed: list[JSON]) -> Feed:
+        header: JSON = header_response[0]["data"]["user"]["profile_header_renderer"]["user"]
+        side: JSON = side_response[-1]["data"]["profile_tile_sections"]["edges"][0]["node"]
         token: str = user_id if header["url"].startswith("https://www.facebook.com/people/") else urlbasename(header["url"])
 
-        self.cursor: str | None = start_cursor
-        self.has_next: bool = bool(start_cursor)
-        self.posts: list[Post] = []
-        self.feed: Feed = Feed(
+        feed: Feed = Feed(
             id=user_id,
             token=token,
             name=header["name"],
@@ -30,25 +349,25 @@ class GetProfile:
         )
 
         if private := header["wem_private_sharing_bundle"]["private_sharing_control_model_for_user"]:
-            self.feed.is_private = private["private_sharing_enabled"]
+            feed.is_private = private["private_sharing_enabled"]
 
         if profile_pic := header["profilePicLarge"]:
-            self.feed.picture_url = profile_pic["uri"]
+            feed.picture_url = profile_pic["uri"]
 
         if cover := header["cover_photo"]:
-            self.feed.cover_url = cover["photo"]["image"]["uri"]
+            feed.cover_url = cover["photo"]["image"]["uri"]
 
         if header["profile_social_context"]:
             for i in header["profile_social_context"]["content"]:
                 if "followers" in i["text"]["text"]:
-                    self.feed.followers = i["text"]["text"].split(" ", 1)[0]
+                    feed.followers = i["text"]["text"].split(" ", 1)[0]
                 elif "following" in i["text"]["text"]:
-                    self.feed.following = i["text"]["text"].split(" ", 1)[0]
+                    feed.following = i["text"]["text"].split(" ", 1)[0]
                 elif "likes" in i["text"]["text"]:
-                    self.feed.likes = i["text"]["text"].split(" ", 1)[0]
+                    feed.likes = i["text"]["text"].split(" ", 1)[0]
 
         if (i := posts_feed[0]["data"]["user"]["delegate_page"]) and (description := i["best_description"]):
-            self.feed.description = description["text"]
+            feed.description = description["text"]
 
         if side["profile_tile_section_type"] == "INTRO":
             for i in side["profile_tile_views"]["nodes"][1]["view_style_renderer"]["view"]["profile_tile_items"]["nodes"]:
@@ -64,38 +383,18 @@ class GetProfile:
                     else:
                         item["url"] = url
                 item["type"] = i["node"]["timeline_context_item"]["timeline_context_list_item_type"][11:].lower()
-                self.feed.info.append(item)
-
-        if not self.cursor:
-            if i := posts_feed[0]["data"]["user"]["timeline_list_feed_units"]["edges"]:
-                self.posts.append(parse_post(i[0]["node"]))
-            for i in posts_feed[1:]:
-                if page_info := i["data"].get("page_info"):
-                    self.cursor = page_info["end_cursor"]
-                    self.has_next = page_info["has_next_page"]
-                    break
-            else:
-                raise InvalidResponse
-        if self.has_next:
-            for _ in range(3):
-                response: list[JSON] = api.ProfileCometTimelineFeedRefetchQuery(user_id, self.cursor)
-                rest: list[JSON] = [i for i in response[1:] if "ProfileCometTimelineFeed_user" in i.get("label", "")]
-
-                if edges := response[0]["data"]["node"]["timeline_list_feed_units"]["edges"]:
-                    self.posts.append(parse_post(edges[0]["node"]))
-                self.posts.extend(parse_post(i["data"]["node"]) for i in rest[:-1])
-                self.cursor = rest[-1]["data"]["page_info"]["end_cursor"]
-                self.has_next = rest[-1]["data"]["page_info"]["has_next_page"]
-                if not self.has_next:
-                    break
+                feed.info.append(item)
 
-        api.close()
+        return feed
 
 
-class GetPost:
-    def __init__(self, start_cursor: str | None, focus: str | None = None, sort: str | None = None) -> None:
-        self.__api: Api = Api()
+class GetPost(Extractor):
+    # The order of the first page of comments the post query embeds.
+    EMBEDDED_SORT: str = "RANKED_FILTERED_INTENT_V1"
 
+    def __init__(
+        self, start_cursor: str | None, focus: str | None = None, sort: str | None = None, *, replies: bool = False
+    ) -> None:
         self.id: str | None = None
         self.cursor: str | None = start_cursor
         self.has_next: bool = bool(start_cursor)
@@ -103,31 +402,41 @@ class GetPost:
         self.sort: str = {
             "all": "RANKED_UNFILTERED_CHRONOLOGICAL_REPLIES_INTENT_V1",
             "newest": "RECENT_ACTIVITY_INTENT_V1",
-        }.get(str(sort), "RANKED_FILTERED_INTENT_V1")
+        }.get(str(sort), self.EMBEDDED_SORT)
+        self.replies: bool = replies
         self.post: Post | None = None
         self.comments: list[Comment] = []
+        self.__expanded: bool = False
 
-    def __fetch(self) -> None:
+    def __fetch(self) -> Steps:
         if not self.id:
             raise NotFound
-        post_payload: JSON = self.__api.CometSinglePostDialogContentQuery(self.id, self.focus)[0]["data"]["node"]
-
-        self.post = parse_post(post_payload)
+        start: str | None = self.cursor
+        post_payload: JSON = {}
+        post: Post | None = self._cached("post", self.id)
+        if post is None:
+            post_payload = (yield Call("CometSinglePostDialogContentQuery", self.id, self.focus))[0]["data"]["node"]
+            post = parse_post(post_payload)
+            self._cache(post, "post", self.id)
+        self.post = post
 
         if self.post.feedback_id is not None:
-            comments_payload: JSON
-            if self.sort:
-                comments_payload = self.__api.CommentListComponentsRootQuery(
-                    self.post.feedback_id,
-                    self.sort,
-                    self.focus,
+            if cached := self._cached("comments", self.post.feedback_id, self.sort, self.focus, self.replies, start):
+                self.comments, self.cursor, self.has_next = cached
+                return
+            # A next page of comments only needs its cursor, a next page of replies the focused comment.
+            comments_payload: JSON = {}
+            if not self.focus and not start and self.sort == self.EMBEDDED_SORT:
+                comments_payload = self.__embedded(post_payload)
+            if not comments_payload and (self.focus or not start):
+                comments_payload = (
+                    yield Call(
+                        "CommentListComponentsRootQuery",
+                        self.post.feedback_id,
+                        self.sort,
+                        self.focus,
+                    )
                 )[0]["data"]["node"]["comment_rendering_instance_for_feed_location"]["comments"]
-            else:
-                comments_payload = post_payload["comet_sections"]["feedback"]["story"]["story_ufi_container"]["story"][
-                    "feedback_context"
-                ]["feedback_target_with_context"]["comment_list_renderer"]["feedback"]["comment_rendering_instance_for_feed_location"][
-                    "comments"
-                ]
 
             if self.focus:
                 main_comment: JSON = comments_payload["edges"][0]["node"]
@@ -139,12 +448,16 @@ class GetPost:
                     self.comments.extend(parse_comment(i["node"]) for i in replies["edges"])
                     self.cursor = replies["page_info"]["end_cursor"]
                     self.has_next = replies["page_info"]["has_next_page"]
+                    yield ()
                 if self.has_next:
-                    for _ in range(2):
-                        next_replies: JSON = self.__api.Depth1CommentsListPaginationQuery(
-                            main_comment["feedback"]["id"],
-                            main_comment["feedback"]["expansion_info"]["expansion_token"],
-                            self.cursor,
+                    for _ in self._pages(2, first=bool(start)):
+                        next_replies: JSON = (
+                            yield Call(
+                                "Depth1CommentsListPaginationQuery",
+                                main_comment["feedback"]["id"],
+                                main_comment["feedback"]["expansion_info"]["expansion_token"],
+                                self.cursor,
+                            )
                         )[0]["data"]["node"]["replies_connection"]
 
                         self.comments.extend(parse_comment(i["node"]) for i in next_replies["edges"])
@@ -152,114 +465,176 @@ class GetPost:
                         self.has_next = next_replies["page_info"]["has_next_page"]
                         if not self.has_next:
                             break
+                        yield ()
             else:
                 if not self.cursor:
                     self.comments.extend(parse_comment(i["node"]) for i in comments_payload["edges"])
                     self.cursor = comments_payload["page_info"]["end_cursor"]
                     self.has_next = comments_payload["page_info"]["has_next_page"]
+                    yield from self.__expand()
+                    yield ()
                 if self.has_next:
-                    for _ in range(2):
-                        next_comments: JSON = self.__api.CommentsListComponentsPaginationQuery(
-                            self.post.feedback_id,
-                            self.cursor,
+                    for _ in self._pages(2, first=bool(start)):
+                        next_comments: JSON = (
+                            yield Call(
+                                "CommentsListComponentsPaginationQuery",
+                                self.post.feedback_id,
+                                self.cursor,
+                            )
                         )[0]["data"]["node"]["comment_rendering_instance_for_feed_location"]["comments"]
 
                         self.comments.extend(parse_comment(i["node"]) for i in next_comments["edges"])
                         self.cursor = next_comments["page_info"]["end_cursor"]
                         self.has_next = next_comments["page_info"]["has_next_page"]
+                        yield from self.__expand()
                         if not self.has_next:
                             break
+                        yield ()
+            if not self.partial:
+                self._cache(
+                    [self.comments, self.cursor, self.has_next],
+                    "comments",
+                    self.post.feedback_id,
+                    self.sort,
+                    self.focus,
+                    self.replies,
+                    start,
+                )
 
-        self.__api.close()
+    def __expand(self) -> Steps:
+        """Inserts the first page of replies of the top comments of the view after each of them, once per view."""
+        if not self.replies or self.__expanded:
+            return
+        self.__expanded = True
+        comments: list[Comment] = [i for i in self.comments if i.replies_count and not i.is_reply][: int(REPLIES["comments"])]
+        if not comments:
+            return
+        results: tuple[list[JSON] | None, ...] = yield Gather(
+            [Call("Depth1CommentsListPaginationQuery", i.feedback_id, i.expansion_token, None) for i in comments],
+            REPLIES["timeout"],
+        )
+        for comment, result in zip(comments, results, strict=True):
+            if result is None:
+                # The view is shown without these replies but kept out of the caches.
+                self.partial: bool = True
+                continue
+            edges: list[JSON] = result[0]["data"]["node"]["replies_connection"]["edges"]
+            index: int = self.comments.index(comment) + 1
+            self.comments[index:index] = [parse_comment(i["node"]) for i in edges]
+
+    def __embedded(self, post_payload: JSON) -> JSON:
+        """Returns the first page of comments embedded in `post_payload`, empty when the post came from the cache."""
+        with suppress(KeyError, TypeError):
+            feedback: JSON = post_payload["comet_sections"]["feedback"]["story"]["story_ufi_container"]["story"][
+                "feedback_context"
+            ]["feedback_target_with_context"]["comment_list_renderer"]["feedback"]
+            return feedback["comment_rendering_instance_for_feed_location"]["comments"] or {}
+        return {}
 
     def from_post(self, username: str | None, token: str | None) -> None:
+        self._run(self.__from_post(username, token))
+
+    def __from_post(self, username: str | None, token: str | None) -> Steps:
         if not username or not token:
             raise NotFound
-        route, route_type = self.__api.route(f"/{username}/posts/{token}")
-        if not route or route_type != "post":
-            raise NotFound
-        self.id = route["rootView"]["props"]["storyID"]
+        self.id = self._cached("permalink", username, token)
+        if not self.id:
+            route, route_type = yield Call("route", f"/{username}/posts/{token}")
+            if not route or route_type != "post":
+                raise NotFound
+            self.id = route["rootView"]["props"]["storyID"]
         if not self.id:
             raise NotFound
-        self.__fetch()
+        yield from self.__fetch()
 
     def from_video(self, username: str, token: str) -> None:
-        route, route_type = self.__api.route(f"/{username}/videos/{token}")
-        if not route or route_type != "videos":
-            raise NotFound
-        props: JSON = route["rootView"]["props"]
-        page_id: str = props["pageID"]
-        post_id: str = props["v"]
-        if not page_id or not post_id:
-            raise NotFound
-        self.id = base64s("S:_I" + page_id + ":" + post_id + ":" + post_id)
-        self.__fetch()
+        self._run(self.__from_video(username, token))
+
+    def __from_video(self, username: str, token: str) -> Steps:
+        self.id = self._cached("permalink", username, token)
+        if not self.id:
+            route, route_type = yield Call("route", f"/{username}/videos/{token}")
+            if not route or route_type != "videos":
+                raise NotFound
+            props: JSON = route["rootView"]["props"]
+            page_id: str = props["pageID"]
+            post_id: str = props["v"]
+            if not page_id or not post_id:
+                raise NotFound
+            self.id = base64s("S:_I" + page_id + ":" + post_id + ":" + post_id)
+        yield from self.__fetch()
 
     def from_reel(self, video_id: str) -> None:
+        self._run(self.__from_reel(video_id))
+
+    def __from_reel(self, video_id: str) -> Steps:
         reel_id: int = 0
         with suppress(ValueError):
             reel_id = int(video_id)
-        video: JSON | None = self.__api.FBReelsRootWithEntrypointQuery(str(reel_id))[0]["data"]["video"]
+        video: JSON | None = (yield Call("FBReelsRootWithEntrypointQuery", str(reel_id)))[0]["data"]["video"]
         if not video:
             raise NotFound
         self.id = video["creation_story"]["id"]
-        self.__fetch()
+        yield from self.__fetch()
 
     def from_group_post(self, group_token: str, token: str) -> None:
-        route, route_type = self.__api.route(f"/groups/{group_token}/posts/{token}")
-        if not route or route_type != "group_post":
-            raise NotFound
-        self.id = route["rootView"]["props"]["storyID"]
+        self._run(self.__from_group_post(group_token, token))
+
+    def __from_group_post(self, group_token: str, token: str) -> Steps:
+        self.id = self._cached("permalink", group_token, token)
+        if not self.id:
+            route, route_type = yield Call("route", f"/groups/{group_token}/posts/{token}")
+            if not route or route_type != "group_post":
+                raise NotFound
+            self.id = route["rootView"]["props"]["storyID"]
         if not self.id:
             raise NotFound
-        self.__fetch()
+        yield from self.__fetch()
 
     def from_photo(self, node_id: str | None) -> None:
+        self._run(self.__from_photo(node_id))
+
+    def __from_photo(self, node_id: str | None) -> Steps:
         if not node_id:
             raise NotFound
-        photo: JSON | None = self.__api.CometPhotoRootContentQuery(node_id)[0]["data"]["currMedia"]
+        photo: JSON | None = (yield Call("CometPhotoRootContentQuery", node_id))[0]["data"]["currMedia"]
         if not photo:
             raise NotFound
         user_id: str = base64s_decode(photo["container_story"]["id"]).split(":")[1]
         self.id = base64s(f"S:{user_id}:VK:{photo['id']}")
-        self.__fetch()
+        yield from self.__fetch()
 
 
-class GetGroup:
+class GetGroup(Extractor):
     def __init__(self, token: str, start_cursor: str | None) -> None:
-        api: Api = Api()
-        route, route_type = api.route(f"/groups/{token}")
-        if not route or route_type != "group":
-            raise NotFound
-        group_id: str = route["rootView"]["props"]["groupID"]
-        header: JSON = api.CometGroupRootQuery(group_id)[0]["data"]["group"]["profile_header_renderer"]["group"]
-        side_panel: JSON = api.GroupsCometDiscussionLayoutRootQuery(group_id)[-1]["data"]["comet_discussion_tab_cards"][0]["group"]
-        posts_feed: list[JSON] = api.CometGroupDiscussionRootSuccessQuery(group_id)
-
         self.cursor: str | None = start_cursor
         self.has_next: bool = bool(start_cursor)
         self.posts: list[Post] = []
-        self.feed: Feed = Feed(
-            id=group_id,
-            token=urlbasename(header["url"]),
-            name=header["name"],
-            description=side_panel["description_with_entities"]["text"],
-            members=header["group_member_profiles"]["formatted_count_text"].split(" ", 1)[0],
-            is_group=True,
-            is_private=side_panel["privacy_info"]["label"]["text"] == "Private",
-        )
-
-        if cover := header["cover_renderer"]["cover_photo_content"]:
-            self.feed.cover_url = cover["photo"]["image"]["uri"]
+        self.feed: Feed
+        self._run(self.__steps(token))
 
-        if locations := side_panel["group_locations"]:
-            self.feed.info = [
-                {
-                    "type": "location",
-                    "text": ", ".join(i["name"] for i in locations),
-                    "url": None,
-                }
-            ]
+    def __steps(self, token: str) -> Steps:
+        start: str | None = self.cursor
+        route, route_type = yield Call("route", f"/groups/{token}")
+        if not route or route_type != "group":
+            raise NotFound
+        group_id: str = route["rootView"]["props"]["groupID"]
+        if cached := self._cached("group", group_id, start):
+            self.feed, self.posts, self.cursor, self.has_next = cached
+            return
+        posts_feed: list[JSON] = []
+        feed: Feed | None = self._cached("feed", group_id)
+        if feed is None:
+            header_response, side_panel_response, posts_feed = yield (
+                Call("CometGroupRootQuery", group_id),
+                Call("GroupsCometDiscussionLayoutRootQuery", group_id),
+                Call("CometGroupDiscussionRootSuccessQuery", group_id),
+            )
+            feed = self.__feed(group_id, header_response, side_panel_response)
+            self._cache(feed, "feed", group_id)
+        elif not self.cursor:
+            posts_feed = yield Call("CometGroupDiscussionRootSuccessQuery", group_id)
+        self.feed = feed
 
         if not self.cursor:
             if post := posts_feed[1]["data"].get("node"):
@@ -272,54 +647,102 @@ class GetGroup:
             else:
                 raise InvalidResponse
         if self.has_next:
-            for _ in range(4):
-                response: list[JSON] = api.GroupsCometFeedRegularStoriesPaginationQuery(group_id, self.cursor)
+            for _ in self._pages(4, first=bool(start)):
+                count: int = sizes.count("GroupsCometFeedRegularStoriesPaginationQuery", SIZE["group"] - len(self.posts))
+                response: list[JSON] = yield Call("GroupsCometFeedRegularStoriesPaginationQuery", group_id, self.cursor, count)
                 rest: list[JSON] = [
                     i for i in response[1:] if "GroupsCometFeedRegularStories_group_group_feed" in i.get("label", "")
                 ]
 
+                before: int = len(self.posts)
                 if edges := response[0]["data"]["node"]["group_feed"]["edges"]:
                     self.posts.append(parse_post(edges[0]["node"]))
                 self.posts.extend(parse_post(i["data"]["node"]) for i in rest[:-1])
                 self.cursor = rest[-1]["data"]["page_info"]["end_cursor"]
                 self.has_next = rest[-1]["data"]["page_info"]["has_next_page"]
-                if not self.has_next:
+                sizes.observe(
+                    "GroupsCometFeedRegularStoriesPaginationQuery", count, len(self.posts) - before, has_next=self.has_next
+                )
+                if not self.has_next or len(self.posts) >= SIZE["group"]:
                     break
+                yield ()
+        self._index(self.posts)
+        if not self.partial:
+            self._cache([self.feed, self.posts, self.cursor, self.has_next], "group", group_id, start)
 
-        api.close()
+    def __feed(self, group_id: str, header_response: list[JSON], side_panel_response: list[JSON]) -> Feed:
+        header: JSON = header_response[0]["data"]["group"]["profile_header_renderer"]["group"]
+        side_panel: JSON = side_panel_response[-1]["data"]["comet_discussion_tab_cards"][0]["group"]
 
+        feed: Feed = Feed(
+            id=group_id,
+            token=urlbasename(header["url"]),
+            name=header["name"],
+            description=side_panel["description_with_entities"]["text"],
+            members=header["group_member_profiles"]["formatted_count_text"].split(" ", 1)[0],
+            is_group=True,
+            is_private=side_panel["privacy_info"]["label"]["text"] == "Private",
+        )
+
+        if cover := header["cover_renderer"]["cover_photo_content"]:
+            feed.cover_url = cover["photo"]["image"]["uri"]
+
+        if locations := side_panel["group_locations"]:
+            feed.info = [
+                {
+                    "type": "location",
+                    "text": ", ".join(i["name"] for i in locations),
+                    "url": None,
+                }
+            ]
 
-class GetAlbum:
+        return feed
+
+
+class GetAlbum(Extractor):
     def __init__(self, token: str | None, start_cursor: str | None) -> None:
         if not token:
             raise NotFound
-        api: Api = Api()
-        album: JSON | None = api.CometPhotoAlbumQuery(token)[0]["data"]["album"]
-        if not album:
-            raise NotFound
 
         self.cursor: str | None = start_cursor
         self.has_next: bool = bool(start_cursor)
         self.items: list[Photo | Video] = []
-        self.title: str = album["title"]["text"]
+        self.title: str
+        self._run(self.__steps(token))
 
-        items: list[JSON] = []
+    def __steps(self, token: str) -> Steps:
+        start: str | None = self.cursor
+        if cached := self._cached("album", token, start):
+            self.title, self.items, self.cursor, self.has_next = cached
+            return
+        album: JSON | None = (yield Call("CometPhotoAlbumQuery", token))[0]["data"]["album"]
+        if not album:
+            raise NotFound
+
+        self.title = album["title"]["text"]
 
         if not self.cursor:
-            items.extend(album["media"]["edges"])
+            self.__items(album["media"]["edges"])
             self.cursor = album["media"]["page_info"]["end_cursor"]
             self.has_next = album["media"]["page_info"]["has_next_page"]
         if self.has_next:
-            for _ in range(3):
-                next_items: JSON = api.CometAlbumPhotoCollagePaginationQuery(album["id"], self.cursor)[0]["data"]["node"]["media"]
+            for _ in self._pages(3, first=bool(start)):
+                count: int = sizes.count("CometAlbumPhotoCollagePaginationQuery", SIZE["album"] - len(self.items))
+                response: list[JSON] = yield Call("CometAlbumPhotoCollagePaginationQuery", album["id"], self.cursor, count)
+                next_items: JSON = response[0]["data"]["node"]["media"]
 
-                items.extend(next_items["edges"])
+                self.__items(next_items["edges"])
                 self.cursor = next_items["page_info"]["end_cursor"]
                 self.has_next = next_items["page_info"]["has_next_page"]
-                if not self.has_next:
+                sizes.observe("CometAlbumPhotoCollagePaginationQuery", count, len(next_items["edges"]), has_next=self.has_next)
+                if not self.has_next or len(self.items) >= SIZE["album"]:
                     break
+        if not self.partial:
+            self._cache([self.title, self.items, self.cursor, self.has_next], "album", token, start)
 
-        for i in items:
+    def __items(self, edges: list[JSON]) -> None:
+        # The items of each page are parsed as it comes, a failed next page keeps them.
+        for i in edges:
             match i["node"]["__typename"]:
                 case "Photo":
                     self.items.append(
@@ -341,18 +764,20 @@ class GetAlbum:
                 case _:
                     pass
 
-        api.close()
-
 
-class Search:
+class Search(Extractor):
     def __init__(self, query: str, category: str | None, start_cursor: str | None) -> None:
         self.cursor: str | None = start_cursor
         self.has_next: bool = bool(start_cursor)
         self.results: list[User | Post] = []
-        if not query:
-            return
+        if query:
+            self._run(self.__steps(query, category))
 
-        api: Api = Api()
+    def __steps(self, query: str, category: str | None) -> Steps:
+        start: str | None = self.cursor
+        if cached := self._cached("search", query, category, start):
+            self.results, self.cursor, self.has_next = cached
+            return
         filters: list[str] = []
         search_type: str
         match category:
@@ -366,12 +791,17 @@ class Search:
             case _:
                 search_type = "PAGES_TAB"
 
-        for _ in range(3):
-            results_payload: JSON = api.SearchCometResultsPaginatedResultsQuery(
-                query,
-                search_type,
-                self.cursor,
-                filters,
+        for _ in self._pages(3, first=True):
+            count: int = sizes.count("SearchCometResultsPaginatedResultsQuery", SIZE["search"] - len(self.results))
+            results_payload: JSON = (
+                yield Call(
+                    "SearchCometResultsPaginatedResultsQuery",
+                    query,
+                    search_type,
+                    self.cursor,
+                    filters,
+                    count,
+                )
             )[0]["data"]["serpResponse"]["results"]
 
             for i in results_payload["edges"]:
@@ -404,7 +834,46 @@ class Search:
 
             self.cursor = results_payload["page_info"]["end_cursor"]
             self.has_next = results_payload["page_info"]["has_next_page"]
-            if not self.has_next:
+            sizes.observe("SearchCometResultsPaginatedResultsQuery", count, len(results_payload["edges"]), has_next=self.has_next)
+            if not self.has_next or len(self.results) >= SIZE["search"]:
                 break
+            yield ()
+        self._index(self.results)
+        if not self.partial:
+            self._cache([self.results, self.cursor, self.has_next], "search", query, category, start)
+
+
+class AsyncGetProfile(AsyncExtractor, GetProfile):
+    pass
+
+
+class AsyncGetPost(AsyncExtractor, GetPost):
+    pass
+
+
+class AsyncGetGroup(AsyncExtractor, GetGroup):
+    pass
+
+
+class AsyncGetAlbum(AsyncExtractor, GetAlbum):
+    pass
+
+
+class AsyncSearch(AsyncExtractor, Search):
+    pass
+
+
+class StreamGetProfile(StreamExtractor, GetProfile):
+    pass
+
+
+class StreamGetPost(StreamExtractor, GetPost):
+    pass
+
+
+class StreamGetGroup(StreamExtractor, GetGroup):
+    pass
+
 
-        api.close()
+class StreamSearch(StreamExtractor, Search):
+    pass
@@ -0,0 +1,243 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from contextlib import suppress
+from typing import Any, cast
+
+import orjson
+
+from .remote import RedisCache
+
+
+class Flights:
+    """Coalesces identical upstream work running at the same time.
+
+    Within a worker, callers of `run` with the key of a call in flight wait for it and share its result. Across workers,
+    the first caller holds a lock on a byte of the lock file in `path` while it runs, and leaves its result next to it
+    when another worker marked that it waits on that lock. Once `share` is given a Redis cache, the lock, the marks and
+    the result are kept there instead and shared by the workers of every node. A caller waits at most `timeout` seconds
+    before running the call itself.
+    """
+
+    def __init__(self) -> None:
+        self.path: str | None = None
+        self.timeout: float = 20
+        self.leaders: int = 0
+        self.coalesced: int = 0
+        self.__writes: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__flights: dict[str, Future[Any]] = {}
+        self.__tasks: dict[str, asyncio.Future[Any]] = {}
+        self.__fd: int | None = None
+        self.__remote: RedisCache | None = None
+
+    def configure(self, path: str | None = None, timeout: float = 20) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.__fd = None
+
+    def share(self, remote: RedisCache | None) -> None:
+        self.__remote = remote
+
+    def run[T](self, key: str, fetch: Callable[[], T]) -> T:
+        with self.__lock:
+            flight: Future[Any] | None = self.__flights.get(key)
+            if leader := flight is None:
+                flight = self.__flights[key] = Future()
+        if not leader:
+            self.coalesced += 1
+            with suppress(TimeoutError):
+                return flight.result(self.timeout)
+            return fetch()
+
+        self.leaders += 1
+        try:
+            result: T = self.__shared(key, fetch)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+
+    async def arun[T](self, key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        flight: asyncio.Future[Any] | None = self.__tasks.get(key)
+        if flight is not None and flight.get_loop() is loop:
+            self.coalesced += 1
+            # Unlike awaiting the flight, waiting for it neither passes on the cancellation of the leader nor cancels it.
+            await asyncio.wait((flight,), timeout=self.timeout)
+            if flight.done() and not flight.cancelled():
+                return flight.result()
+            return await fetch()
+
+        self.leaders += 1
+        flight = self.__tasks[key] = loop.create_future()
+        # Marks the exception as retrieved when no other caller waits for it.
+        flight.add_done_callback(lambda i: i.cancelled() or i.exception())
+        try:
+            result: T = await self.__ashared(key, fetch)
+        except asyncio.CancelledError:
+            # The callers waiting for a cancelled leader run the call themselves.
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            if self.__tasks.get(key) is flight:
+                del self.__tasks[key]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.__flights) + len(self.__tasks),
+        }
+
+    def reset(self) -> None:
+        # Record locks belong to the process, the child takes its own with a new descriptor.
+        self.__lock = threading.Lock()
+        self.__flights = {}
+        self.__fd = None
+
+    def __shared[T](self, key: str, fetch: Callable[[], T]) -> T:
+        if not self.path and not self.__remote:
+            return fetch()
+        name: str = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        start: float = time.time()
+        deadline: float = start + self.timeout
+        if not (locked := self.__acquire(name)):
+            self.__wait(name)
+        while not locked and time.time() < deadline:
+            time.sleep(0.02)
+            locked = self.__acquire(name)
+        try:
+            if (result := self.__result(name, start)) is not None:
+                self.coalesced += 1
+                return cast("T", result)
+            result = fetch()
+            self.__store(name, result)
+            return result
+        finally:
+            if locked:
+                self.__release(name)
+
+    async def __ashared[T](self, key: str, fetch: Callable[[], Awaitable[T]]) -> T:
+        if not self.path and not self.__remote:
+            return await fetch()
+        # The lock, the marks and the result are files or on another server, they are handled off the event loop.
+        name: str = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        start: float = time.time()
+        deadline: float = start + self.timeout
+        if not (locked := await asyncio.to_thread(self.__acquire, name)):
+            await asyncio.to_thread(self.__wait, name)
+        while not locked and time.time() < deadline:
+            await asyncio.sleep(0.02)
+            locked = await asyncio.to_thread(self.__acquire, name)
+        try:
+            if (result := await asyncio.to_thread(self.__result, name, start)) is not None:
+                self.coalesced += 1
+                return cast("T", result)
+            result = await fetch()
+            await asyncio.to_thread(self.__store, name, result)
+            return result
+        finally:
+            if locked:
+                await asyncio.to_thread(self.__release, name)
+
+    def __acquire(self, name: str) -> bool:
+        if self.__remote:
+            return self.__remote.lock(f"flight:{name}", self.timeout)
+        fd: int = self.__lock_file()
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, int(name[:8], 16))
+        except (BlockingIOError, PermissionError):
+            return False
+        return True
+
+    def __release(self, name: str) -> None:
+        if self.__remote:
+            self.__remote.unlock(f"flight:{name}")
+            return
+        fcntl.lockf(self.__lock_file(), fcntl.LOCK_UN, 1, int(name[:8], 16))
+
+    def __result(self, name: str, since: float) -> Any | None:  # noqa: ANN401
+        # Only a result written while this caller waited is from the same call.
+        if self.__remote:
+            with suppress(orjson.JSONDecodeError, TypeError, ValueError):
+                if data := self.__remote.get(f"flight:{name}:result"):
+                    written, result = orjson.loads(data)
+                    return result if written >= since else None
+            return None
+        file: str = os.path.join(str(self.path), name)
+        with suppress(OSError, orjson.JSONDecodeError):
+            if os.stat(file).st_mtime >= since:
+                with open(file, "rb") as f:
+                    return orjson.loads(f.read())
+        return None
+
+    def __wait(self, name: str) -> None:
+        # Marks that a caller waits for the result, the leader only writes it out then.
+        if self.__remote:
+            self.__remote.set(f"flight:{name}:waiting", b"1", self.timeout)
+            return
+        with suppress(OSError), open(os.path.join(str(self.path), f"{name}.waiting"), "wb"):
+            pass
+        self.__written()
+
+    def __store(self, name: str, result: object) -> None:
+        if self.__remote:
+            if self.__remote.get(f"flight:{name}:waiting") is None:
+                return
+            with suppress(orjson.JSONEncodeError):
+                self.__remote.set(f"flight:{name}:result", orjson.dumps([time.time(), result]), self.timeout * 2)
+            self.__remote.delete(f"flight:{name}:waiting")
+            return
+        file: str = os.path.join(str(self.path), name)
+        try:
+            os.unlink(f"{file}.waiting")
+        except OSError:
+            return
+        temp: str = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # The result is only shared, the caller has it either way.
+        with suppress(OSError, orjson.JSONEncodeError):
+            with open(temp, "wb") as f:
+                f.write(orjson.dumps(result))
+            os.replace(temp, file)
+        self.__written()
+
+    def __written(self) -> None:
+        self.__writes += 1
+        if self.__writes % 256 == 0:
+            self.__clean()
+
+    def __clean(self) -> None:
+        expired: float = time.time() - self.timeout * 2
+        for entry in os.scandir(str(self.path)):
+            with suppress(OSError):
+                if entry.name != "lock" and entry.stat().st_mtime < expired:
+                    os.unlink(entry.path)
+
+    def __lock_file(self) -> int:
+        # One descriptor per process, closing any descriptor of the file would release every lock of the process.
+        if self.__fd is None:
+            os.makedirs(str(self.path), exist_ok=True)
+            self.__fd = os.open(os.path.join(str(self.path), "lock"), os.O_CREAT | os.O_RDWR)
+        return self.__fd
+
+
+flights: Flights = Flights()
+
+os.register_at_fork(after_in_child=flights.reset)
@@ -0,0 +1,84 @@
+import hashlib
+from collections.abc import Iterable, Iterator
+from typing import Any, cast
+
+import orjson
+from flask import current_app, g, request
+from jinja2.runtime import Macro
+from markupsafe import Markup
+
+from ..jinja_filters import format_time
+from .cache import MemoryCache
+from .expiry import expiry
+from .parsers import dump
+
+
+class FragmentCache:
+    """Caches the HTML rendered by the post and comment macros.
+
+    A fragment is keyed by the id of the rendered object, a hash of its content and everything else the macro output
+    depends on: the macro arguments, the proxy setting, the host, the endpoint and sort order of reply links and the
+    relative times shown. The theme only changes the stylesheet, every theme shares the same fragments. `preload` reads
+    the fragments of each upstream page of items with a single multi-get before they are rendered.
+    """
+
+    def __init__(self) -> None:
+        self.ttl: float = 600
+        self.fragments: MemoryCache = MemoryCache(32 * 1024 * 1024)
+
+    def configure(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 600) -> None:
+        self.ttl = ttl
+        self.fragments.configure(max_bytes)
+
+    def preload[T](self, macro: Macro, batches: Iterable[list[T]], *args: object, **kwargs: object) -> Iterator[T]:
+        """Iterates over the items of `batches`, reading the fragments `render` is then called for with the same
+        arguments in a single multi-get per batch.
+        """
+        preloaded: dict[str, bytes | None] = g.setdefault("fragments", {})
+        for batch in batches:
+            # Search results mix users in, only the items the macro is named after are read.
+            items: list[Any] = [i for i in batch if type(i).__name__ == macro.name]
+            if self.ttl and items:
+                keys: list[str] = [self.__key(macro, i, args, kwargs) for i in items]
+                preloaded.update(zip(keys, self.fragments.get_many(keys), strict=True))
+            yield from batch
+
+    def render(self, macro: Macro, item: Any, *args: object, **kwargs: object) -> str:  # noqa: ANN401
+        if not self.ttl:
+            return macro(item, *args, **kwargs)
+        key: str = self.__key(macro, item, args, kwargs)
+        preloaded: dict[str, bytes | None] = g.get("fragments", {})
+        cached: bytes | None = preloaded.pop(key) if key in preloaded else self.fragments.get(key)
+        if cached is not None:
+            # The URLs of the fragment are counted as the proxy filter counted them when it was rendered.
+            expiry.count_cached(cached)
+            # The fragment was escaped when it was rendered.
+            return Markup(cached.decode())  # noqa: S704
+
+        html: str = macro(item, *args, **kwargs)
+        data: bytes = html.encode()
+        self.fragments.set(key, data, expiry.ttl(data, self.ttl))
+        return html
+
+    def stats(self) -> dict[str, int]:
+        return self.fragments.stats()
+
+    def __key(self, macro: Macro, item: Any, args: tuple[object, ...], kwargs: dict[str, object]) -> str:  # noqa: ANN401
+        settings: dict[str, str] = cast("dict[str, str]", current_app.config["DEFAULT_SETTINGS"])
+        times: list[str] = [format_time(i.time) for i in (item, getattr(item, "shared_post", None)) if i is not None]
+        context: list[object] = [
+            macro.name,
+            args,
+            kwargs,
+            request.cookies.get("proxy", settings["proxy"]),
+            request.host_url,
+            request.endpoint,
+            request.view_args,
+            request.args.get("sort"),
+            times,
+        ]
+        digest: str = hashlib.blake2b(orjson.dumps(context, default=str) + dump(item), digest_size=16).hexdigest()
+        return f"{macro.name}:{item.id}:{digest}"
+
+
+fragments: FragmentCache = FragmentCache()
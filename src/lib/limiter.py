@@ -0,0 +1,200 @@
+import asyncio
+import fcntl
+import os
+import random
+import struct
+import threading
+import time
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+from .exceptions import Unavailable
+
+# Failures worth another attempt, the upstream answer may differ a moment later.
+TRANSIENT: tuple[type[Exception], ...] = (Unavailable, httpx.TransportError)
+
+# Tokens, time of the last refill and current rate of the bucket.
+STATE: struct.Struct = struct.Struct("ddd")
+
+
+class Limiter:
+    """Token bucket paced upstream requests, the rate adapts to the upstream errors.
+
+    The bucket refills at the current rate up to `burst` tokens. A transient failure multiplies the rate by `decrease`,
+    down to `min_rate` requests per second, and each success adds `increase` back up to `max_rate`. With a `path` the
+    bucket is kept in that file and every worker draws from it. A failed request is retried up to `retries` times after
+    an exponential backoff from `backoff` seconds with full jitter, capped at `max_backoff`. Nothing waits past the
+    deadline of the page, `deadline` seconds after its first upstream request, and nothing is sent after it.
+    """
+
+    def __init__(self) -> None:
+        self.path: str | None = None
+        self.max_rate: float = 20
+        self.min_rate: float = 1
+        self.burst: float = 20
+        self.increase: float = 0.5
+        self.decrease: float = 0.5
+        self.retries: int = 2
+        self.backoff: float = 0.5
+        self.max_backoff: float = 5
+        self.deadline: float = 20
+        self.waits: int = 0
+        self.throttled: int = 0
+        self.retried: int = 0
+        self.failures: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__state: tuple[float, float, float] | None = None
+        self.__fd: int | None = None
+
+    def configure(
+        self,
+        path: str | None = None,
+        max_rate: float = 20,
+        min_rate: float = 1,
+        burst: float = 20,
+        increase: float = 0.5,
+        decrease: float = 0.5,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 5,
+        deadline: float = 20,
+    ) -> None:
+        self.path = path
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.reset()
+
+    def page_deadline(self) -> float | None:
+        """Returns the deadline of a page starting now."""
+        return time.time() + self.deadline if self.deadline else None
+
+    def call[T](self, fetch: Callable[[], T], deadline: float | None) -> T:
+        attempt: int = 0
+        while True:
+            self.__check(deadline)
+            time.sleep(self.__take(deadline))
+            try:
+                result: T = fetch()
+            except TRANSIENT:
+                self.__adapt(failed=True)
+                if (delay := self.__retry(attempt, deadline)) is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+            else:
+                self.__adapt(failed=False)
+                return result
+
+    async def acall[T](self, fetch: Callable[[], Awaitable[T]], deadline: float | None) -> T:
+        attempt: int = 0
+        while True:
+            self.__check(deadline)
+            # The bucket may be kept in a file locked by every worker, it is updated off the event loop.
+            await asyncio.sleep(await asyncio.to_thread(self.__take, deadline))
+            try:
+                result: T = await fetch()
+            except TRANSIENT:
+                await asyncio.to_thread(self.__adapt, failed=True)
+                if (delay := self.__retry(attempt, deadline)) is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                await asyncio.to_thread(self.__adapt, failed=False)
+                return result
+
+    def stats(self) -> dict[str, float]:
+        tokens, _, rate = self.__update(lambda tokens, updated, rate: (tokens, updated, rate))
+        return {
+            "rate": round(rate, 2),
+            "tokens": round(tokens, 2),
+            "waits": self.waits,
+            "throttled": self.throttled,
+            "retries": self.retried,
+            "failures": self.failures,
+        }
+
+    def reset(self) -> None:
+        # The lock of the state file belongs to the process, the child opens its own descriptor.
+        self.__lock = threading.Lock()
+        self.__state = None
+        self.__fd = None
+
+    def __check(self, deadline: float | None) -> None:
+        # A page past its deadline sends nothing more, that is neither an upstream failure nor worth a token.
+        if deadline is not None and time.time() >= deadline:
+            raise Unavailable("Facebook took too long to answer")
+
+    def __take(self, deadline: float | None) -> float:
+        """Takes a token and returns the seconds until it is available, the bucket goes negative for the waiting."""
+        tokens, _, rate = self.__update(lambda tokens, updated, rate: (tokens - 1, updated, rate))
+        if tokens >= 0:
+            return 0
+        delay: float = -tokens / rate
+        if deadline is not None and time.time() + delay > deadline:
+            # The token is given back, the page fails now instead of at its deadline.
+            self.__update(lambda tokens, updated, rate: (tokens + 1, updated, rate))
+            self.throttled += 1
+            raise Unavailable("Too many requests to Facebook, try again later")
+        self.waits += 1
+        return delay
+
+    def __retry(self, attempt: int, deadline: float | None) -> float | None:
+        self.failures += 1
+        if attempt >= self.retries:
+            return None
+        delay: float = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))  # noqa: S311
+        if deadline is not None and time.time() + delay > deadline:
+            return None
+        self.retried += 1
+        return delay
+
+    def __adapt(self, *, failed: bool) -> None:
+        def adapt(tokens: float, updated: float, rate: float) -> tuple[float, float, float]:
+            rate = max(self.min_rate, rate * self.decrease) if failed else min(self.max_rate, rate + self.increase)
+            return tokens, updated, rate
+
+        self.__update(adapt)
+
+    def __update(self, change: Callable[[float, float, float], tuple[float, float, float]]) -> tuple[float, float, float]:
+        """Refills the bucket and applies `change` to its state, under the lock of every worker sharing it."""
+        with self.__lock:
+            fd: int | None = self.__state_file()
+            if fd is not None:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                now: float = time.time()
+                state: tuple[float, float, float] = self.__state or (self.burst, now, self.max_rate)
+                if fd is not None and len(data := os.pread(fd, STATE.size, 0)) == STATE.size:
+                    state = STATE.unpack(data)
+                tokens, updated, rate = state
+                rate = min(max(rate, self.min_rate), self.max_rate)
+                state = change(min(self.burst, tokens + max(now - updated, 0) * rate), now, rate)
+                self.__state = state
+                if fd is not None:
+                    os.pwrite(fd, STATE.pack(*state), 0)
+                return state
+            finally:
+                if fd is not None:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def __state_file(self) -> int | None:
+        if not self.path:
+            return None
+        if self.__fd is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.__fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        return self.__fd
+
+
+limiter: Limiter = Limiter()
+
+os.register_at_fork(after_in_child=limiter.reset)
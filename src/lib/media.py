@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import suppress
+from typing import Any
+
+import orjson
+
+
+class MediaCache:
+    """Disk cache of proxied fbcdn files, evicted least recently used first once `max_bytes` is exceeded.
+
+    Files are addressed by a hash of their upstream path and query, the response headers and the expiry of the signed
+    URL are kept in a JSON file next to them. A file is written while it streams to the first client and only becomes
+    visible once complete.
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.path: str | None = path
+        self.max_bytes: int = max_bytes
+        self.size: int | None = None
+        self.hits: int = 0
+        self.misses: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+
+    def configure(self, path: str | None = None, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = None
+
+    def key(self, path: str, query: bytes) -> str:
+        return hashlib.sha256(path.encode() + b"?" + query).hexdigest()
+
+    def get(self, key: str) -> tuple[str, dict[str, str]] | None:
+        if not self.path:
+            return None
+        file: str = self.__file(key)
+        try:
+            with open(file + ".json", "rb") as f:
+                meta: dict[str, Any] = orjson.loads(f.read())
+            expired: bool = meta["expires"] is not None and meta["expires"] < time.time()
+            if not expired:
+                os.utime(file)
+        except (OSError, KeyError, orjson.JSONDecodeError):
+            self.misses += 1
+            return None
+        if expired:
+            # The signed upstream URL is dead, no page links to this copy anymore.
+            self.__remove(file)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return file, meta["headers"]
+
+    def fill(self, key: str, chunks: Iterator[bytes], headers: dict[str, str], expires: float | None) -> Iterator[bytes]:
+        if not self.path:
+            yield from chunks
+            return
+        file: str = self.__file(key)
+        temp: str = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size: int = 0
+        complete: bool = False
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        try:
+            with open(temp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            with open(file + ".json", "wb") as f:
+                f.write(orjson.dumps({"expires": expires, "headers": headers}))
+            os.replace(temp, file)
+            complete = True
+        finally:
+            if not complete:
+                os.unlink(temp)
+        self.__added(size)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "bytes": self.size or 0,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __file(self, key: str) -> str:
+        return os.path.join(str(self.path), key[:2], key)
+
+    def __added(self, size: int) -> None:
+        with self.__lock:
+            if self.size is None:
+                self.__evict()
+            else:
+                self.size += size
+                if self.size > self.max_bytes:
+                    self.__evict()
+
+    def __evict(self) -> None:
+        # Every worker shares the directory, so the real size is taken from disk before evicting.
+        files: list[tuple[float, int, str]] = []
+        for root, _, names in os.walk(str(self.path)):
+            for name in names:
+                if name.endswith((".json", ".tmp")):
+                    continue
+                file: str = os.path.join(root, name)
+                try:
+                    stat: os.stat_result = os.stat(file)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file))
+        files.sort()
+        self.size = sum(i[1] for i in files)
+        target: float = self.max_bytes * 0.9 if self.size > self.max_bytes else self.max_bytes
+        while files and self.size > target:
+            _, size, file = files.pop(0)
+            self.__remove(file)
+            self.size -= size
+
+    def __remove(self, file: str) -> None:
+        for i in (file, file + ".json"):
+            with suppress(FileNotFoundError):
+                os.unlink(i)
+
+
+media: MediaCache = MediaCache()
@@ -0,0 +1,166 @@
+import io
+import os
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import timedelta
+from typing import Any, cast
+
+import orjson
+from flask import Flask, current_app, g, request
+from werkzeug import Response
+from werkzeug.test import run_wsgi_app
+
+from .cache import MemoryCache
+
+# Seconds a rendered page of each endpoint is served from the cache, 0 or a missing endpoint disables caching.
+PAGE_TTL: dict[str, float] = {
+    "profile.profile": 60,
+    "profile.php": 60,
+    "groups.groups": 60,
+    "posts.posts": 60,
+    "posts.videos": 60,
+    "posts.reel": 60,
+    "posts.groups_posts": 60,
+    "posts.photo": 60,
+    "posts.permalink": 60,
+    "albums.albums": 300,
+    "search.search": 60,
+}
+
+REFRESH: str = "phice.page_refresh"
+
+
+class PageCache:
+    """Caches whole rendered pages by URL and the settings cookies they are rendered with.
+
+    A page older than its TTL is still served for `stale` more seconds while a single background request renders it
+    again. Only complete 200 responses are stored, error pages and pages cut short by a failed upstream request are not.
+    """
+
+    def __init__(self) -> None:
+        self.stale: float = 300
+        self.workers: int = 2
+        self.pages: MemoryCache = MemoryCache()
+        self.stale_hits: int = 0
+        self.refreshes: int = 0
+        self.__app: Flask | None = None
+        self.__lock: threading.Lock = threading.Lock()
+        self.__refreshing: set[str] = set()
+        self.__executor: ThreadPoolExecutor | None = None
+
+    def configure(self, max_bytes: int = 64 * 1024 * 1024, stale: float = 300, workers: int = 2) -> None:
+        self.stale = stale
+        self.workers = workers
+        self.pages.configure(max_bytes)
+
+    def init_app(self, app: Flask) -> None:
+        self.__app = app
+        app.before_request(self.serve)
+        app.after_request(self.store)
+
+    def serve(self) -> Response | None:
+        ttl: float = PAGE_TTL.get(str(request.endpoint), 0)
+        if request.method != "GET" or not ttl or not self.pages.max_bytes:
+            return None
+        key: str = self.__key()
+        # The page is stored by `store` once its body is sent, `skip` empties the list to keep it out.
+        g.page = [key]
+        if request.environ.get(REFRESH) or (cached := self.pages.get(key)) is None:
+            return None
+
+        meta, body = cached.split(b"\n", 1)
+        rendered, content_type = orjson.loads(meta)
+        age: float = time.time() - rendered
+        if age > ttl:
+            self.stale_hits += 1
+            self.__refresh(key)
+        g.page = []
+        response: Response = Response(body, content_type=content_type)
+        response.age = timedelta(seconds=int(age))
+        return response
+
+    def store(self, response: Response) -> Response:
+        page: list[str] | None = g.get("page")
+        if page and response.status_code == 200:
+            content_type: str = response.content_type or "text/html; charset=utf-8"
+            ttl: float = PAGE_TTL.get(str(request.endpoint), 0) + self.stale
+            response.response = self.__fill(page, response.response, content_type, ttl)
+        return response
+
+    def skip(self) -> None:
+        """Keeps the page of the current request out of the cache."""
+        if page := g.get("page"):
+            page.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.pages.stats(),
+            "stale": self.stale_hits,
+            "refreshes": self.refreshes,
+            "refreshing": len(self.__refreshing),
+        }
+
+    def reset(self) -> None:
+        self.__lock = threading.Lock()
+        self.__refreshing = set()
+        self.__executor = None
+
+    def __fill(self, page: list[str], chunks: Iterable[bytes | str], content_type: str, ttl: float) -> Iterator[bytes]:
+        body: bytearray = bytearray()
+        try:
+            for chunk in chunks:
+                data: bytes = chunk.encode() if isinstance(chunk, str) else chunk
+                body += data
+                yield data
+        finally:
+            if close := getattr(chunks, "close", None):
+                close()
+        # An error handler or a partial stream may have emptied the list while the body was sent.
+        if page:
+            self.pages.set(page[0], orjson.dumps([time.time(), content_type]) + b"\n" + bytes(body), ttl)
+
+    def __refresh(self, key: str) -> None:
+        if not self.workers or not self.__app:
+            return
+        environ: dict[str, Any] = {**request.environ, REFRESH: True, "wsgi.input": io.BytesIO()}
+        environ.pop("werkzeug.request", None)
+        with self.__lock:
+            if key in self.__refreshing:
+                return
+            self.__refreshing.add(key)
+            self.refreshes += 1
+            self.__pool().submit(self.__render, self.__app, key, environ)
+
+    def __render(self, app: Flask, key: str, environ: dict[str, Any]) -> None:
+        try:
+            # A failed refresh leaves the stale page until it expires, the next stale hit tries again.
+            with suppress(Exception):
+                body, _, _ = run_wsgi_app(app, environ)
+                try:
+                    for _ in body:
+                        pass
+                finally:
+                    if close := getattr(body, "close", None):
+                        close()
+        finally:
+            with self.__lock:
+                self.__refreshing.discard(key)
+
+    def __key(self) -> str:
+        settings: dict[str, str] = cast("dict[str, str]", current_app.config["DEFAULT_SETTINGS"])
+        args: list[tuple[str, str]] = sorted(request.args.items(multi=True))
+        cookies: list[str] = [request.cookies.get(i, v) for i, v in settings.items()]
+        return "page:" + orjson.dumps([request.base_url, args, cookies]).decode()
+
+    def __pool(self) -> ThreadPoolExecutor:
+        if not self.__executor:
+            self.__executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pages")
+        return self.__executor
+
+
+pages: PageCache = PageCache()
+
+os.register_at_fork(after_in_child=pages.reset)
@@ -0,0 +1,89 @@
+import os
+import threading
+
+# Items upstream returns for each paginated query when asked for `count` items, the count it is first asked for.
+COUNT: dict[str, int] = {
+    "ProfileCometTimelineFeedRefetchQuery": 3,
+    "GroupsCometFeedRegularStoriesPaginationQuery": 3,
+    "CometAlbumPhotoCollagePaginationQuery": 14,
+    "SearchCometResultsPaginatedResultsQuery": 5,
+}
+
+# Items a page view of each extractor gathers before it stops fetching next upstream pages.
+SIZE: dict[str, int] = {
+    "profile": 10,
+    "group": 13,
+    "album": 56,
+    "search": 15,
+}
+
+
+class PageSizes:
+    """Learns the largest `count` each paginated query is honoured with, so that a page fills in the fewest requests.
+
+    A query is first asked for its configured count. While upstream returns as many items as were asked for with more
+    pages left, the next request for a full count asks for twice as many, up to `max_count`. Fewer items with more pages
+    left may be the most upstream returns for the query, it is asked for that many next, never fewer than the configured
+    count. A single short page may be a page upstream trimmed, the count only stops growing once `short_pages` pages came
+    back short. A worker learns on its own and starts over when it restarts.
+    """
+
+    def __init__(self) -> None:
+        self.max_count: int = 50
+        self.short_pages: int = 3
+        self.grown: int = 0
+        self.capped: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__counts: dict[str, int] = dict(COUNT)
+        self.__short: dict[str, int] = {}
+
+    def configure(
+        self,
+        max_count: int = 50,
+        short_pages: int = 3,
+        count: dict[str, int] | None = None,
+        size: dict[str, int] | None = None,
+    ) -> None:
+        self.max_count = max_count
+        self.short_pages = short_pages
+        COUNT.update(count or {})
+        SIZE.update(size or {})
+        self.__counts = dict(COUNT)
+        self.__short = {}
+
+    def count(self, query: str, wanted: int) -> int:
+        """Returns the count to ask `query` for when `wanted` more items fill the page."""
+        return max(1, min(wanted, self.__counts[query]))
+
+    def observe(self, query: str, asked: int, returned: int, *, has_next: bool) -> None:
+        """Records that `query` asked for `asked` items returned `returned`.
+
+        Only a request for the full count with more pages left tells how many items upstream returns.
+        """
+        with self.__lock:
+            current: int = self.__counts[query]
+            if not has_next or asked != current:
+                return
+            if returned < asked:
+                self.__short[query] = self.__short.get(query, 0) + 1
+                if self.__short[query] == self.short_pages:
+                    self.capped += 1
+                self.__counts[query] = max(returned, COUNT[query])
+            elif self.__short.get(query, 0) < self.short_pages and current < self.max_count:
+                self.grown += 1
+                self.__counts[query] = min(current * 2, self.max_count)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.__counts,
+            "grown": self.grown,
+            "capped": self.capped,
+        }
+
+    def reset(self) -> None:
+        self.__lock = threading.Lock()
+
+
+sizes: PageSizes = PageSizes()
+
+os.register_at_fork(after_in_child=sizes.reset)
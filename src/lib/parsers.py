@@ -1,4 +1,5 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+from typing import Any, cast
 
 import orjson
 
@@ -6,12 +7,12 @@ from .api import JSON
 from .utils import base64s_decode, urlbasename
 
 
-@dataclass
+@dataclass(slots=True)
 class Unsupported:
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Photo:
     url: str
     id: str | None = None
@@ -19,7 +20,7 @@ class Photo:
     alt_text: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Video:
     id: str
     url: str | None
@@ -27,31 +28,31 @@ class Video:
     thumbnail_url: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class AnimatedImage:
     url: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Event:
     name: str
     description: str
     time: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Unavailable:
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Poll:
     text: str
     total: int
     options: list[tuple[str, int, int]] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class Feed:
     id: str
     token: str
@@ -69,7 +70,7 @@ class Feed:
     info: list[dict[str, str | None]] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     id: str
     username: str | None
@@ -79,14 +80,14 @@ class User:
     description: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Group:
     id: str
     username: str
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Post:
     id: str
     post_id: str
@@ -108,7 +109,7 @@ class Post:
     voters_count: int | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Comment:
     id: str
     feedback_id: str
@@ -418,3 +419,60 @@ def parse_post(node: JSON, *, shared: bool = False) -> Post:
     post.text = "\n".join(text)
 
     return post
+
+
+RECORDS: list[type[object]] = [Unsupported, Photo, Video, AnimatedImage, Event, Unavailable, Poll, Feed, User, Group, Post, Comment]
+RECORD_INDEX: dict[type[object], int] = {j: i for i, j in enumerate(RECORDS)}
+LIST: int = -1
+TUPLE: int = -2
+USER: int = -3
+
+
+def dump(value: object) -> bytes:
+    """Serializes parsed objects to a compact orjson array.
+
+    A record is an array of its type index and its field values, lists and tuples are tagged the same way.
+    Each user is stored once and referenced by its index, a timeline repeats the same author on every post. Users are
+    told apart by all their fields, the same id may come with different fields within one page.
+    """
+    users: dict[tuple[object, ...], int] = {}
+    table: list[object] = []
+
+    def encode(value: Any) -> Any:  # noqa: ANN401
+        if isinstance(value, User):
+            user: tuple[object, ...] = tuple(getattr(value, j.name) for j in fields(value))
+            if (i := users.get(user)) is None:
+                i = users[user] = len(table)
+                table.append(user)
+            return [USER, i]
+        if (i := RECORD_INDEX.get(value.__class__)) is not None:
+            return [i, *(encode(getattr(value, j.name)) for j in fields(value))]
+        if isinstance(value, list | tuple):
+            items: list[Any] | tuple[Any, ...] = cast("list[Any] | tuple[Any, ...]", value)
+            return [LIST if isinstance(items, list) else TUPLE, *(encode(i) for i in items)]
+        if isinstance(value, dict):
+            return {k: encode(v) for k, v in cast("dict[str, Any]", value).items()}
+        return value
+
+    return orjson.dumps([table, encode(value)])
+
+
+def load(data: bytes) -> Any:  # noqa: ANN401
+    table, encoded = orjson.loads(data)
+    users: list[User] = [User(*i) for i in table]
+
+    def decode(value: Any) -> Any:  # noqa: ANN401
+        if isinstance(value, list):
+            tag, *items = cast("list[Any]", value)
+            if tag == LIST:
+                return [decode(i) for i in items]
+            if tag == TUPLE:
+                return tuple(decode(i) for i in items)
+            if tag == USER:
+                return users[int(items[0])]
+            return RECORDS[int(tag)](*(decode(i) for i in items))
+        if isinstance(value, dict):
+            return {k: decode(v) for k, v in cast("dict[str, Any]", value).items()}
+        return value
+
+    return decode(encoded)
@@ -0,0 +1,101 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import httpx
+
+
+class Pool:
+    """Long-lived upstream clients shared by every request of a worker.
+
+    httpx clients are thread-safe, so a single client per base URL, headers and timeout is shared between gthread workers.
+    Clients keep no cookies, upstream would otherwise see every visitor of the worker as the same one.
+    Async clients are bound to the event loop of the worker, an ASGI worker runs a single loop.
+    Independent upstream queries are run concurrently on a bounded executor.
+    The pool is dropped in forked children so sockets and threads of the master are never reused.
+    """
+
+    def __init__(self) -> None:
+        self.limits: httpx.Limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+        self.max_workers: int = 16
+        self.__lock: threading.Lock = threading.Lock()
+        self.__clients: dict[tuple[object, ...], httpx.Client] = {}
+        self.__async_clients: dict[tuple[object, ...], httpx.AsyncClient] = {}
+        self.__executor: ThreadPoolExecutor | None = None
+
+    def configure(
+        self,
+        max_connections: int | None = 100,
+        max_keepalive_connections: int | None = 20,
+        keepalive_expiry: float | None = 30,
+        max_workers: int = 16,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_workers = max_workers
+        with self.__lock:
+            for client in self.__clients.values():
+                client.close()
+            self.__clients.clear()
+            self.__async_clients.clear()
+            if self.__executor:
+                self.__executor.shutdown(wait=False)
+                self.__executor = None
+
+    def client(self, base_url: str, headers: dict[str, str] | None = None, timeout: float = 15) -> httpx.Client:
+        key: tuple[object, ...] = self.__key(base_url, headers, timeout)
+        if client := self.__clients.get(key):
+            return client
+        with self.__lock:
+            if not (client := self.__clients.get(key)):
+                client = self.__clients[key] = httpx.Client(
+                    base_url=base_url,
+                    headers=headers,
+                    cookies=self.__cookies(),
+                    timeout=timeout,
+                    limits=self.limits,
+                )
+        return client
+
+    def async_client(self, base_url: str, headers: dict[str, str] | None = None, timeout: float = 15) -> httpx.AsyncClient:
+        key: tuple[object, ...] = self.__key(base_url, headers, timeout)
+        if not (client := self.__async_clients.get(key)):
+            client = self.__async_clients[key] = httpx.AsyncClient(
+                base_url=base_url,
+                headers=headers,
+                cookies=self.__cookies(),
+                timeout=timeout,
+                limits=self.limits,
+            )
+        return client
+
+    def executor(self) -> ThreadPoolExecutor:
+        if executor := self.__executor:
+            return executor
+        with self.__lock:
+            if not (executor := self.__executor):
+                executor = self.__executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="upstream")
+        return executor
+
+    def __key(self, base_url: str, headers: dict[str, str] | None, timeout: float) -> tuple[object, ...]:
+        return base_url, tuple(sorted((headers or {}).items())), timeout
+
+    def __cookies(self) -> CookieJar:
+        # No domain is allowed, the Set-Cookie headers of upstream are dropped.
+        return CookieJar(DefaultCookiePolicy(allowed_domains=[]))
+
+    def reset(self) -> None:
+        # Called in the child after fork: the inherited connections belong to the parent, so they are dropped, not closed.
+        self.__lock = threading.Lock()
+        self.__clients = {}
+        self.__async_clients = {}
+        self.__executor = None
+
+
+pool: Pool = Pool()
+
+os.register_at_fork(after_in_child=pool.reset)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+
+from flask import g
+
+
+class Prefetcher:
+    """Fetches the next page of a paginated view in the background, so the "Next" click is served from memory.
+
+    Pages are keyed by path, query arguments and cursor. Prefetching is skipped while the worker serves more than
+    `max_load` requests, and prefetches still waiting in the queue are cancelled when that happens.
+    """
+
+    def __init__(self) -> None:
+        self.workers: int = 2
+        self.max_entries: int = 128
+        self.ttl: float = 60
+        self.max_load: int = 32
+        self.requests: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.cancelled: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__pages: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self.__pending: dict[Hashable, Future[None]] = {}
+        self.__executor: ThreadPoolExecutor | None = None
+
+    def configure(self, workers: int = 2, max_entries: int = 128, ttl: float = 60, max_load: int = 32) -> None:
+        self.workers = workers
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_load = max_load
+
+    def take[T](self, kind: type[T], path: str, args: Mapping[str, str]) -> T | None:
+        key: Hashable = self.__key(path, args, args.get("cursor"))
+        with self.__lock:
+            expires, page = self.__pages.pop(key, (0, None))
+        if expires > time.time() and isinstance(page, kind):
+            self.hits += 1
+            return page
+        self.misses += 1
+        return None
+
+    def schedule(self, path: str, args: Mapping[str, str], cursor: str | None, fetch: Callable[[str], object]) -> None:
+        if not cursor or not self.workers:
+            return
+        key: Hashable = self.__key(path, args, cursor)
+        with self.__lock:
+            if self.requests > self.max_load or key in self.__pages or key in self.__pending:
+                return
+            if len(self.__pending) >= self.workers * 2:
+                return
+            self.__pending[key] = self.__pool().submit(self.__fetch, key, cursor, fetch)
+
+    def enter(self) -> None:
+        g.prefetch_load = True
+        with self.__lock:
+            self.requests += 1
+            if self.requests > self.max_load:
+                for key, future in list(self.__pending.items()):
+                    if future.cancel():
+                        del self.__pending[key]
+                        self.cancelled += 1
+
+    def leave(self, _: BaseException | None = None) -> None:
+        # A streamed template pushes the request context again and runs the teardown handlers a second time.
+        if not g.pop("prefetch_load", False):
+            return
+        with self.__lock:
+            self.requests = max(self.requests - 1, 0)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pages": len(self.__pages),
+            "pending": len(self.__pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+        }
+
+    def reset(self) -> None:
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__executor = None
+
+    def __fetch(self, key: Hashable, cursor: str, fetch: Callable[[str], object]) -> None:
+        try:
+            # A failed prefetch is dropped, the page is fetched again when it is requested.
+            with suppress(Exception):
+                page: object = fetch(cursor)
+                with self.__lock:
+                    self.__pages[key] = (time.time() + self.ttl, page)
+                    while len(self.__pages) > self.max_entries:
+                        self.__pages.popitem(last=False)
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    def __pool(self) -> ThreadPoolExecutor:
+        if not self.__executor:
+            self.__executor = ThreadPoolExecutor(self.workers, thread_name_prefix="prefetch")
+        return self.__executor
+
+    def __key(self, path: str, args: Mapping[str, str], cursor: str | None) -> Hashable:
+        return path, tuple(sorted((k, v) for k, v in args.items() if k != "cursor")), cursor
+
+
+prefetcher: Prefetcher = Prefetcher()
+
+os.register_at_fork(after_in_child=prefetcher.reset)
@@ -0,0 +1,201 @@
+import os
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING, override
+from urllib.parse import SplitResult, unquote, urlsplit
+
+from .cache import Cache
+
+if TYPE_CHECKING:
+    from io import BufferedReader
+
+type Reply = bytes | int | list[Reply] | None
+
+
+class RedisError(Exception):
+    """An error reply of the server."""
+
+
+class Connection:
+    """Connection to a server speaking the Redis protocol, commands sent together are pipelined."""
+
+    def __init__(self, address: tuple[str, int], timeout: float) -> None:
+        self.socket: socket.socket = socket.create_connection(address, timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file: BufferedReader = self.socket.makefile("rb")
+
+    def send(self, *commands: tuple[bytes | str | float, ...]) -> list[Reply]:
+        data: bytearray = bytearray()
+        for command in commands:
+            data += b"*%d\r\n" % len(command)
+            for arg in command:
+                value: bytes = arg if isinstance(arg, bytes) else str(arg).encode()
+                data += b"$%d\r\n%s\r\n" % (len(value), value)
+        self.socket.sendall(data)
+        return [self.__read() for _ in commands]
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def __read(self) -> Reply:
+        line: bytes = self.file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the server")
+        kind, value = line[:1], line[1:-2]
+        match kind:
+            case b"+":
+                return value
+            case b"-":
+                raise RedisError(value.decode(errors="replace"))
+            case b":":
+                return int(value)
+            case b"$":
+                return None if int(value) < 0 else self.file.read(int(value) + 2)[:-2]
+            case b"*":
+                return None if int(value) < 0 else [self.__read() for _ in range(int(value))]
+            case _:
+                raise ConnectionError(f"Unexpected reply: {line!r}")
+
+
+class RedisCache(Cache):
+    """Cache kept by a server speaking the Redis protocol, shared by the workers of every node pointed to it.
+
+    Keys are prefixed with `namespace` and `version`, bumping the version drops the entries of an older release at once.
+    Idle connections are pooled per process, up to `max_connections`. A server that fails is left alone for `retry`
+    seconds, the caches miss meanwhile instead of waiting on it.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        namespace: str = "phice",
+        version: int = 1,
+        max_connections: int = 16,
+        timeout: float = 1,
+        retry: float = 5,
+        max_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        super().__init__(max_bytes)
+        self.url: str | None = url
+        self.namespace: str = namespace
+        self.version: int = version
+        self.max_connections: int = max_connections
+        self.timeout: float = timeout
+        self.retry: float = retry
+        self.errors: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__idle: list[Connection] = []
+        self.__down_until: float = 0
+
+    def configure(
+        self,
+        url: str | None = None,
+        namespace: str = "phice",
+        version: int = 1,
+        max_connections: int = 16,
+        timeout: float = 1,
+        retry: float = 5,
+        max_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        self.url = url
+        self.namespace = namespace
+        self.version = version
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retry = retry
+        self.max_bytes: int = max_bytes
+        self.reset()
+
+    def lock(self, key: str, ttl: float) -> bool:
+        """Takes the lock `key` for at most `ttl` seconds, or until `unlock`. An unavailable server grants every lock."""
+        replies: list[Reply] | None = self.__send(("SET", self.__key(key), b"1", "NX", "PX", int(ttl * 1000)))
+        return replies is None or replies[0] is not None
+
+    def unlock(self, key: str) -> None:
+        # A lock that outlived its TTL may belong to another caller by now, it then only costs that caller a wait.
+        self.__send(("DEL", self.__key(key)))
+
+    def reset(self) -> None:
+        # Connections belong to the process, the child opens its own.
+        self.__lock = threading.Lock()
+        self.__idle = []
+        self.__down_until = 0
+
+    @override
+    def _get(self, key: str) -> bytes | None:
+        return self._get_many([key])[0]
+
+    @override
+    def _get_many(self, keys: list[str]) -> list[bytes | None]:
+        replies: list[Reply] | None = self.__send(("MGET", *(self.__key(i) for i in keys)))
+        if replies is None or not isinstance(values := replies[0], list):
+            return [None] * len(keys)
+        return [i if isinstance(i, bytes) else None for i in values]
+
+    @override
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        self.__send(("SET", self.__key(key), value, "PX", max(int(ttl * 1000), 1)))
+
+    @override
+    def _delete(self, key: str) -> None:
+        self.__send(("DEL", self.__key(key)))
+
+    @override
+    def _stats(self) -> dict[str, int]:
+        return {
+            "max_bytes": self.max_bytes,
+            "connections": len(self.__idle),
+            "errors": self.errors,
+        }
+
+    def __key(self, key: str) -> str:
+        return f"{self.namespace}:{self.version}:{key}"
+
+    def __send(self, *commands: tuple[bytes | str | float, ...]) -> list[Reply] | None:
+        if not self.url or time.time() < self.__down_until:
+            return None
+        connection: Connection | None = None
+        try:
+            connection = self.__connection()
+            replies: list[Reply] = connection.send(*commands)
+        except (OSError, RedisError, ValueError):
+            # A failed connection may hold unread replies, it is dropped.
+            if connection:
+                connection.close()
+            self.errors += 1
+            self.__down_until = time.time() + self.retry
+            return None
+        with self.__lock:
+            if len(self.__idle) < self.max_connections:
+                self.__idle.append(connection)
+                connection = None
+        if connection:
+            connection.close()
+        return replies
+
+    def __connection(self) -> Connection:
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop()
+        url: SplitResult = urlsplit(str(self.url))
+        connection: Connection = Connection((url.hostname or "localhost", url.port or 6379), self.timeout)
+        setup: list[tuple[bytes | str | float, ...]] = []
+        if url.password:
+            user: tuple[str, ...] = (unquote(url.username),) if url.username else ()
+            setup.append(("AUTH", *user, unquote(url.password)))
+        if database := url.path.strip("/"):
+            setup.append(("SELECT", database))
+        try:
+            if setup:
+                connection.send(*setup)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+
+remote: RedisCache = RedisCache()
+
+os.register_at_fork(after_in_child=remote.reset)
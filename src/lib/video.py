@@ -0,0 +1,167 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+import httpx
+import orjson
+
+from .cache import MemoryCache
+from .expiry import expiry
+from .pool import pool
+
+
+class ReadAhead:
+    """Serves range requests for proxied videos from fixed size chunks kept in memory.
+
+    A request starting where the previous one of the same video ended is sequential playback, the next `ahead` chunks
+    are then read in the background. Each video has at most one upstream read at a time, on the pooled connection, a
+    request for missing chunks waits for the read in flight and takes the chunks it read.
+    """
+
+    def __init__(self) -> None:
+        self.chunk_size: int = 1024 * 1024
+        self.ahead: int = 4
+        self.ttl: float = 600
+        self.workers: int = 4
+        self.chunks: MemoryCache = MemoryCache(256 * 1024 * 1024)
+        self.reads: int = 0
+        self.sequential: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__read_done: threading.Condition = threading.Condition(self.__lock)
+        self.__next: OrderedDict[str, int] = OrderedDict()
+        self.__reading: set[str] = set()
+        self.__executor: ThreadPoolExecutor | None = None
+
+    def configure(
+        self,
+        chunk_size: int = 1024 * 1024,
+        ahead: int = 4,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 600,
+        workers: int = 4,
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.ahead = ahead
+        self.ttl = ttl
+        self.workers = workers
+        self.chunks.configure(max_bytes)
+
+    def serve(self, key: str, path: str, query: bytes, start: int, stop: int | None) -> tuple[bytes, int, str] | None:
+        """Returns the bytes from `start` up to `stop`, or to the end of the chunk when open ended, the file size
+        and its content type. Returns None when upstream does not answer with a range.
+
+        At most `ahead` chunks past the first are returned, the client asks for the rest of a larger range.
+        """
+        first: int = start // self.chunk_size
+        last: int = min((stop - 1) // self.chunk_size, first + self.ahead) if stop is not None else first
+        chunks: list[bytes | None] = [self.chunks.get(f"{key}:{i}") for i in range(first, last + 1)]
+        meta: bytes | None = self.chunks.get(f"{key}:meta")
+        if meta is not None and start >= orjson.loads(meta)[0]:
+            return None
+        if meta is None or None in chunks:
+            if not (fetched := self.__read_missing(key, path, query, first, last)):
+                return None
+            meta, chunks = fetched
+        total, mimetype = orjson.loads(meta)
+        if start >= total:
+            return None
+
+        data: bytes = b"".join(i or b"" for i in chunks)[start - first * self.chunk_size :]
+        if stop is not None:
+            data = data[: stop - start]
+        with self.__lock:
+            sequential: bool = start in (0, self.__next.get(key))
+            self.__next[key] = start + len(data)
+            self.__next.move_to_end(key)
+            while len(self.__next) > 1024:
+                self.__next.popitem(last=False)
+            if sequential:
+                self.sequential += 1
+            if sequential and self.workers and key not in self.__reading:
+                ahead: range = range(last + 1, min(last + 1 + self.ahead, -(-total // self.chunk_size)))
+                if ahead:
+                    self.__reading.add(key)
+                    self.__pool().submit(self.__read_ahead, key, path, query, ahead)
+        return data, total, mimetype
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.chunks.stats(),
+            "reads": self.reads,
+            "sequential": self.sequential,
+            "reading": len(self.__reading),
+        }
+
+    def reset(self) -> None:
+        self.__lock = threading.Lock()
+        self.__read_done = threading.Condition(self.__lock)
+        self.__reading = set()
+        self.__executor = None
+
+    def __read_ahead(self, key: str, path: str, query: bytes, ahead: range) -> None:
+        try:
+            missing: list[int] = [i for i in ahead if self.chunks.get(f"{key}:{i}") is None]
+            # A failed read ahead is dropped, the chunk is read again when it is requested.
+            with suppress(httpx.HTTPError):
+                if missing:
+                    self.__read(key, path, query, missing[0], missing[-1])
+        finally:
+            self.__done(key)
+
+    def __read_missing(self, key: str, path: str, query: bytes, first: int, last: int) -> tuple[bytes, list[bytes | None]] | None:
+        with self.__read_done:
+            while key in self.__reading:
+                self.__read_done.wait()
+            self.__reading.add(key)
+        try:
+            # The read waited for may have read the chunks.
+            chunks: list[bytes | None] = [self.chunks.get(f"{key}:{i}") for i in range(first, last + 1)]
+            if (meta := self.chunks.get(f"{key}:meta")) is not None and None not in chunks:
+                return meta, chunks
+            return self.__read(key, path, query, first, last)
+        finally:
+            self.__done(key)
+
+    def __done(self, key: str) -> None:
+        with self.__read_done:
+            self.__reading.discard(key)
+            self.__read_done.notify_all()
+
+    def __read(self, key: str, path: str, query: bytes, first: int, last: int) -> tuple[bytes, list[bytes | None]] | None:
+        # The chunks are read with a single upstream request.
+        client: httpx.Client = pool.client("https://scontent.xx.fbcdn.net")
+        headers: dict[str, str] = {"range": f"bytes={first * self.chunk_size}-{(last + 1) * self.chunk_size - 1}"}
+        self.reads += 1
+        with client.stream("GET", f"/{path}", params=query, headers=headers) as response:
+            content_range: str | None = response.headers.get("content-range")
+            if response.status_code != 206 or not content_range or "/" not in content_range:
+                return None
+            ttl: float = expiry.ttl(query, self.ttl)
+            meta: bytes = orjson.dumps([int(content_range.rsplit("/", 1)[1]), response.headers.get("content-type", "video/mp4")])
+            self.chunks.set(f"{key}:meta", meta, ttl)
+            chunks: list[bytes | None] = []
+            buffer: bytearray = bytearray()
+            for data in response.iter_bytes():
+                buffer += data
+                while len(buffer) >= self.chunk_size:
+                    chunk: bytes = bytes(buffer[: self.chunk_size])
+                    self.chunks.set(f"{key}:{first + len(chunks)}", chunk, ttl)
+                    chunks.append(chunk)
+                    del buffer[: self.chunk_size]
+            if buffer:
+                # The last chunk of the file is shorter.
+                self.chunks.set(f"{key}:{first + len(chunks)}", bytes(buffer), ttl)
+                chunks.append(bytes(buffer))
+        return meta, chunks
+
+    def __pool(self) -> ThreadPoolExecutor:
+        if not self.__executor:
+            self.__executor = ThreadPoolExecutor(self.workers, thread_name_prefix="readahead")
+        return self.__executor
+
+
+readahead: ReadAhead = ReadAhead()
+
+os.register_at_fork(after_in_child=readahead.reset)
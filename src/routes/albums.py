@@ -1,7 +1,12 @@
+from functools import partial
+
 from flask import Blueprint, abort, render_template, request
 
+from ..asgi import async_view
 from ..lib.exceptions import NotFound
-from ..lib.extractor import GetAlbum
+from ..lib.extractor import AsyncGetAlbum, GetAlbum
+from ..lib.pages import pages
+from ..lib.prefetch import prefetcher
 
 bp: Blueprint = Blueprint("albums", __name__)
 
@@ -9,10 +14,39 @@ bp: Blueprint = Blueprint("albums", __name__)
 @bp.route("/media/set")
 def albums() -> str:
     try:
-        album = GetAlbum(request.args.get("set"), request.args.get("cursor"))
+        album = prefetcher.take(GetAlbum, request.path, request.args) or GetAlbum(
+            request.args.get("set"),
+            request.args.get("cursor"),
+        )
     except NotFound:
         abort(404, "Album not found")
 
+    return render(album)
+
+
+@async_view("albums.albums")
+async def albums_async() -> str:
+    try:
+        album = prefetcher.take(GetAlbum, request.path, request.args) or await AsyncGetAlbum(
+            request.args.get("set"),
+            request.args.get("cursor"),
+        )
+    except NotFound:
+        abort(404, "Album not found")
+
+    return render(album)
+
+
+def render(album: GetAlbum) -> str:
+    if album.partial:
+        pages.skip()
+    prefetcher.schedule(
+        request.path,
+        request.args,
+        album.cursor if album.has_next else None,
+        partial(GetAlbum, request.args.get("set")),
+    )
+
     return render_template(
         "album.html.jinja",
         items=album.items,
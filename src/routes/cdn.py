@@ -1,18 +1,76 @@
-import httpx
-from flask import Blueprint, make_response, request
+import mimetypes
+from typing import TYPE_CHECKING
+
+from flask import Blueprint, make_response, request, send_file
 from werkzeug import Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import http_date, parse_date
+
+from ..lib.expiry import expiry
+from ..lib.media import media
+from ..lib.pool import pool
+from ..lib.video import readahead
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    import httpx
+
+MAX_AGE: int = 31536000  # 1 year, a signed fbcdn URL always points to the same file
 
 bp: Blueprint = Blueprint("cdn", __name__)
 
 
+def immutable(response: Response, key: str) -> Response:
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @bp.route("/cdn/<path:path>")
 def cdn(path: str) -> Response:
-    cdn_headers: dict[str, str] = {}
-    if rrange := request.headers.get("range"):
-        cdn_headers["range"] = rrange
+    key: str = media.key(path, request.query_string)
+    # A copy tagged with the key of this URL is the current one, If-Modified-Since is checked against the cached file or
+    # left to upstream, a copy kept from a failed request would never be refreshed otherwise.
+    if request.if_none_match.contains_weak(key):
+        return immutable(Response(status=304), key)
+
+    if cached := media.get(key):
+        # Range and conditional requests are answered from the file, with sendfile when the server supports it.
+        file, cached_headers = cached
+        response: Response = send_file(
+            file,
+            mimetype=cached_headers.get("content-type", "application/octet-stream"),
+            conditional=True,
+            etag=key,
+            max_age=MAX_AGE,
+            last_modified=parse_date(cached_headers.get("last-modified")),
+        )
+        return immutable(response, key)
+
+    # Video playback is answered chunk by chunk from the read ahead store.
+    if (
+        (rrange := request.range)
+        and "if-range" not in request.headers
+        and (mimetypes.guess_type(path)[0] or "").startswith("video/")
+        and len(rrange.ranges) == 1
+        and rrange.ranges[0][0] >= 0
+        and (video := readahead.serve(key, path, request.query_string, *rrange.ranges[0]))
+    ):
+        data, total, mimetype = video
+        response = Response(data, 206, mimetype=mimetype)
+        response.content_range = ContentRange("bytes", rrange.ranges[0][0], rrange.ranges[0][0] + len(data), total)
+        response.accept_ranges = "bytes"
+        return immutable(response, key)
 
-    client: httpx.Client = httpx.Client(headers=cdn_headers)
-    cdn_request: httpx.Request = client.build_request("GET", f"https://scontent.xx.fbcdn.net/{path}", params=request.query_string)
+    cdn_headers: dict[str, str] = {
+        k: v for k, v in request.headers.items() if k.lower() in ("range", "if-range", "if-none-match", "if-modified-since")
+    }
+
+    client: httpx.Client = pool.client("https://scontent.xx.fbcdn.net")
+    cdn_request: httpx.Request = client.build_request("GET", f"/{path}", params=request.query_string, headers=cdn_headers)
     cdn_response: httpx.Response = client.send(cdn_request, stream=True)
 
     headers: dict[str, str] = {
@@ -32,11 +90,24 @@ def cdn(path: str) -> Response:
             "x-fb-vts-requestid",
         )
     }
-    response: Response = make_response(cdn_response.iter_raw(), cdn_response.status_code, headers)
+    body: Iterator[bytes] = cdn_response.iter_raw()
+    # Only whole, unencoded files are cached, a ranged first request is proxied as is.
+    if cdn_response.status_code == 200 and "range" not in cdn_headers and "content-encoding" not in headers:
+        body = media.fill(
+            key,
+            body,
+            {
+                "content-type": headers.get("content-type", "application/octet-stream"),
+                "last-modified": headers.get("last-modified", http_date()),
+            },
+            expiry.of(request.query_string),
+        )
+    response = make_response(body, cdn_response.status_code, headers)
+    if cdn_response.status_code in (200, 206, 304):
+        immutable(response, key)
 
     @response.call_on_close
     def close() -> None:  # pyright: ignore[reportUnusedFunction]
         cdn_response.close()
-        client.close()
 
     return response
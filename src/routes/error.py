@@ -1,13 +1,18 @@
+import math
+
 from flask import Blueprint, abort, render_template
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
 
-from ..lib.exceptions import InvalidResponse, ResponseError
+from ..lib.exceptions import InvalidResponse, ResponseError, Unavailable
+from ..lib.limiter import limiter
+from ..lib.pages import pages
 
 bp: Blueprint = Blueprint("error_handlers", __name__)
 
 
 @bp.app_errorhandler(HTTPException)
 def error_handler(e: HTTPException) -> tuple[str, int]:
+    pages.skip()
     return render_template("error.html.jinja", e=e, title="Error"), e.code or 200
 
 
@@ -19,3 +24,11 @@ def invaled_reponse_handler(_: InvalidResponse) -> str:
 @bp.app_errorhandler(ResponseError)
 def response_error_handler(e: ResponseError) -> str:
     abort(500, str(e))
+
+
+@bp.app_errorhandler(Unavailable)
+def unavailable_handler(e: Unavailable) -> tuple[str, int, dict[str, str]]:
+    # Aborting from an error handler would end up as a 500, the page is rendered here.
+    pages.skip()
+    error: ServiceUnavailable = ServiceUnavailable(str(e))
+    return render_template("error.html.jinja", e=error, title="Error"), 503, {"Retry-After": str(math.ceil(limiter.max_backoff))}
@@ -1,18 +1,38 @@
-from flask import Blueprint, abort, current_app, render_template, request
+from functools import partial
 
+from flask import Blueprint, abort, current_app, render_template, request, stream_template
+from flask.typing import ResponseReturnValue
+
+from ..asgi import async_view
 from ..lib.exceptions import NotFound
-from ..lib.extractor import GetGroup
+from ..lib.extractor import AsyncGetGroup, GetGroup, StreamGetGroup
+from ..lib.pages import pages
+from ..lib.prefetch import prefetcher
 
 bp: Blueprint = Blueprint("groups", __name__)
 
 
 @bp.route("/groups/<string:token>")
-def groups(token: str) -> str | tuple[str, dict[str, str]]:
+def groups(token: str) -> ResponseReturnValue:
+    try:
+        group = prefetcher.take(GetGroup, request.path, request.args) or StreamGetGroup(token, request.args.get("cursor"))
+    except NotFound:
+        abort(404, f"{token} not found")
+
+    return render(group, token)
+
+
+@async_view("groups.groups")
+async def groups_async(token: str) -> ResponseReturnValue:
     try:
-        group = GetGroup(token, request.args.get("cursor"))
+        group = prefetcher.take(GetGroup, request.path, request.args) or await AsyncGetGroup(token, request.args.get("cursor"))
     except NotFound:
         abort(404, f"{token} not found")
 
+    return render(group, token)
+
+
+def render(group: GetGroup, token: str) -> ResponseReturnValue:
     if request.args.get("rss"):
         if not current_app.config["ENABLE_RSS"]:
             abort(403, "RSS feeds are disabled in this instance")
@@ -20,14 +40,18 @@ def groups(token: str) -> str | tuple[str, dict[str, str]]:
         return render_template(
             "timeline.rss.jinja",
             info=group.feed,
-            posts=group.posts,
+            posts=list(group.stream(group.posts)),
         ), {"content-type": "application/rss+xml"}
 
-    return render_template(
+    def done() -> None:
+        if group.partial:
+            pages.skip()
+        prefetcher.schedule(request.path, request.args, group.cursor if group.has_next else None, partial(GetGroup, token))
+
+    return stream_template(
         "timeline.html.jinja",
         info=group.feed,
-        posts=group.posts,
-        cursor=group.cursor,
-        has_next=group.has_next,
+        posts=group.batches(group.posts, done),
+        page=group,
         title=group.feed.name,
     )
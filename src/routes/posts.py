@@ -1,9 +1,17 @@
+from collections.abc import Mapping
+from functools import partial
+from typing import cast
+
 import httpx
-from flask import Blueprint, abort, redirect, render_template, request
+from flask import Blueprint, abort, current_app, redirect, request, stream_template
+from flask.typing import ResponseReturnValue
 from werkzeug import Response
 
+from ..asgi import async_view
 from ..lib.exceptions import NotFound
-from ..lib.extractor import GetPost
+from ..lib.extractor import AsyncGetPost, GetPost, StreamGetPost
+from ..lib.pages import pages
+from ..lib.prefetch import prefetcher
 from ..lib.utils import nohostname
 
 bp: Blueprint = Blueprint("posts", __name__)
@@ -17,39 +25,109 @@ bp: Blueprint = Blueprint("posts", __name__)
 @bp.route("/photo.php", defaults={"author": "", "token": ""}, endpoint="photo")
 @bp.route("/photo", defaults={"author": "", "token": ""}, endpoint="photo")
 @bp.route("/permalink.php", defaults={"author": "", "token": ""}, endpoint="permalink")
-def posts(author: str, token: str) -> str:
-    post = GetPost(
-        request.args.get("cursor"),
-        request.args.get("comment_id"),
-        request.args.get("sort"),
-    )
+def posts(author: str, token: str) -> ResponseReturnValue:
+    try:
+        post = prefetched() or fetch(
+            request.endpoint,
+            request.args,
+            author,
+            token,
+            request.args.get("cursor"),
+            StreamGetPost,
+            replies=replies(),
+        )
+    except NotFound:
+        abort(404, "Post not found")
 
+    return render(post, author, token)
+
+
+@async_view("posts.posts", "posts.videos", "posts.reel", "posts.groups_posts", "posts.photo", "posts.permalink")
+async def posts_async(author: str, token: str) -> ResponseReturnValue:
     try:
-        match request.endpoint:
-            case "posts.videos":
-                post.from_video(author, token)
-            case "posts.reel":
-                post.from_reel(token)
-            case "posts.groups_posts":
-                post.from_group_post(author, token)
-            case "posts.photo":
-                post.from_photo(request.args.get("fbid"))
-            case "posts.permalink":
-                post.from_post(request.args.get("id"), request.args.get("story_fbid"))
-            case _:
-                post.from_post(author, token)
+        post = prefetched()
+        if post is None:
+            post = AsyncGetPost(
+                request.args.get("cursor"),
+                request.args.get("comment_id"),
+                request.args.get("sort"),
+                replies=replies(),
+            )
+            load(post, request.endpoint, request.args, author, token)
+            await post
     except NotFound:
         abort(404, "Post not found")
 
+    return render(post, author, token)
+
+
+def fetch(
+    endpoint: str | None,
+    args: Mapping[str, str],
+    author: str,
+    token: str,
+    cursor: str | None,
+    kind: type[GetPost] = GetPost,
+    *,
+    replies: bool = False,
+) -> GetPost:
+    post = kind(
+        cursor,
+        args.get("comment_id"),
+        args.get("sort"),
+        replies=replies,
+    )
+    load(post, endpoint, args, author, token)
+
+    return post
+
+
+def replies() -> bool:
+    settings: dict[str, str] = cast("dict[str, str]", current_app.config["DEFAULT_SETTINGS"])
+    return request.cookies.get("replies", settings["replies"]) == "on"
+
+
+def prefetched() -> GetPost | None:
+    # Prefetched pages are keyed by URL, a page fetched with the other replies setting is fetched again.
+    post: GetPost | None = prefetcher.take(GetPost, request.path, request.args)
+    return post if post is not None and post.replies == replies() else None
+
+
+def load(post: GetPost, endpoint: str | None, args: Mapping[str, str], author: str, token: str) -> None:
+    match endpoint:
+        case "posts.videos":
+            post.from_video(author, token)
+        case "posts.reel":
+            post.from_reel(token)
+        case "posts.groups_posts":
+            post.from_group_post(author, token)
+        case "posts.photo":
+            post.from_photo(args.get("fbid"))
+        case "posts.permalink":
+            post.from_post(args.get("id"), args.get("story_fbid"))
+        case _:
+            post.from_post(author, token)
+
+
+def render(post: GetPost, author: str, token: str) -> ResponseReturnValue:
     if post.post is None:
         abort(500)
 
-    return render_template(
+    def done() -> None:
+        if post.partial:
+            pages.skip()
+        prefetcher.schedule(
+            request.path,
+            request.args,
+            post.cursor if post.has_next else None,
+            partial(fetch, request.endpoint, request.args, author, token, replies=post.replies),
+        )
+
+    return stream_template(
         "post.html.jinja",
         post=post.post,
-        comments=post.comments,
-        cursor=post.cursor,
-        has_next=post.has_next,
+        comments=post.batches(post.comments, done),
+        page=post,
         title=post.post.text[:58],
     )
 
@@ -1,7 +1,13 @@
-from flask import Blueprint, abort, current_app, render_template, request
+from functools import partial
 
+from flask import Blueprint, abort, current_app, render_template, request, stream_template
+from flask.typing import ResponseReturnValue
+
+from ..asgi import async_view
 from ..lib.exceptions import NotFound
-from ..lib.extractor import GetProfile
+from ..lib.extractor import AsyncGetProfile, GetProfile, StreamGetProfile
+from ..lib.pages import pages
+from ..lib.prefetch import prefetcher
 
 bp: Blueprint = Blueprint("profile", __name__)
 
@@ -9,14 +15,33 @@ bp: Blueprint = Blueprint("profile", __name__)
 @bp.route("/profile.php", endpoint="php")
 @bp.route("/people/<string:_>/<string:username>")
 @bp.route("/<string:username>")
-def profile(username: str = "", _: str | None = None) -> str | tuple[str, dict[str, str]]:
+def profile(username: str = "", _: str | None = None) -> ResponseReturnValue:
+    token: str = request.args.get("id", "") if request.endpoint == "php" else username
+
+    try:
+        profile = prefetcher.take(GetProfile, request.path, request.args) or StreamGetProfile(token, request.args.get("cursor"))
+    except NotFound:
+        abort(404, f"{username} not found")
+
+    return render(profile, token)
+
+
+@async_view("profile.profile", "profile.php")
+async def profile_async(username: str = "", _: str | None = None) -> ResponseReturnValue:
     token: str = request.args.get("id", "") if request.endpoint == "php" else username
 
     try:
-        profile = GetProfile(token, request.args.get("cursor"))
+        profile = prefetcher.take(GetProfile, request.path, request.args) or await AsyncGetProfile(
+            token,
+            request.args.get("cursor"),
+        )
     except NotFound:
         abort(404, f"{username} not found")
 
+    return render(profile, token)
+
+
+def render(profile: GetProfile, token: str) -> ResponseReturnValue:
     if request.args.get("rss"):
         if not current_app.config["ENABLE_RSS"]:
             abort(403, "RSS feeds are disabled in this instance")
@@ -24,14 +49,18 @@ def profile(username: str = "", _: str | None = None) -> str | tuple[str, dict[s
         return render_template(
             "timeline.rss.jinja",
             info=profile.feed,
-            posts=profile.posts,
+            posts=list(profile.stream(profile.posts)),
         ), {"content-type": "application/rss+xml"}
 
-    return render_template(
+    def done() -> None:
+        if profile.partial:
+            pages.skip()
+        prefetcher.schedule(request.path, request.args, profile.cursor if profile.has_next else None, partial(GetProfile, token))
+
+    return stream_template(
         "timeline.html.jinja",
         info=profile.feed,
-        posts=profile.posts,
-        cursor=profile.cursor,
-        has_next=profile.has_next,
+        posts=profile.batches(profile.posts, done),
+        page=profile,
         title=profile.feed.name,
     )
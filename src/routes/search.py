@@ -1,26 +1,60 @@
-from flask import Blueprint, abort, render_template, request
+from functools import partial
 
-from ..lib.extractor import Search
+from flask import Blueprint, abort, request, stream_template
+from flask.typing import ResponseReturnValue
+
+from ..asgi import async_view
+from ..lib.extractor import AsyncSearch, Search, StreamSearch
+from ..lib.pages import pages
+from ..lib.prefetch import prefetcher
 
 bp: Blueprint = Blueprint("search", __name__)
 
 
 @bp.route("/search")
-def search() -> str:
+def search() -> ResponseReturnValue:
     query: str | None = request.args.get("q")
     if not query:
         abort(400, "Bad query")
 
-    results = Search(
+    results = prefetcher.take(Search, request.path, request.args) or StreamSearch(
         query,
         request.args.get("t"),
         request.args.get("cursor"),
     )
 
-    return render_template(
+    return render(query, results)
+
+
+@async_view("search.search")
+async def search_async() -> ResponseReturnValue:
+    query: str | None = request.args.get("q")
+    if not query:
+        abort(400, "Bad query")
+
+    results = prefetcher.take(Search, request.path, request.args) or await AsyncSearch(
+        query,
+        request.args.get("t"),
+        request.args.get("cursor"),
+    )
+
+    return render(query, results)
+
+
+def render(query: str, results: Search) -> ResponseReturnValue:
+    def done() -> None:
+        if results.partial:
+            pages.skip()
+        prefetcher.schedule(
+            request.path,
+            request.args,
+            results.cursor if results.has_next else None,
+            partial(Search, query, request.args.get("t")),
+        )
+
+    return stream_template(
         "search.html.jinja",
-        results=results.results,
-        cursor=results.cursor,
-        has_next=results.has_next,
+        results=results.batches(results.results, done),
+        page=results,
         title=query + " - Search",
     )
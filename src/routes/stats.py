@@ -0,0 +1,42 @@
+from collections.abc import Mapping
+
+from flask import Blueprint, abort, current_app
+
+from ..lib.api import responses, routes
+from ..lib.cache import store
+from ..lib.expiry import expiry
+from ..lib.extractor import parsed
+from ..lib.flight import flights
+from ..lib.fragments import fragments
+from ..lib.limiter import limiter
+from ..lib.media import media
+from ..lib.pages import pages
+from ..lib.paging import sizes
+from ..lib.prefetch import prefetcher
+from ..lib.remote import remote
+from ..lib.video import readahead
+
+bp: Blueprint = Blueprint("stats", __name__)
+
+
+@bp.route("/stats.json")
+def stats() -> dict[str, Mapping[str, float]]:
+    if not current_app.config["ENABLE_STATS"]:
+        abort(403, "Stats are disabled in this instance")
+
+    return {
+        "responses": responses.stats(),
+        "parsed": parsed.stats(),
+        "fragments": fragments.stats(),
+        "routes": routes.stats(),
+        "store": store.stats(),
+        "remote": remote.stats(),
+        "prefetch": prefetcher.stats(),
+        "flights": flights.stats(),
+        "limiter": limiter.stats(),
+        "pages": pages.stats(),
+        "sizes": sizes.stats(),
+        "media": media.stats(),
+        "urls": expiry.stats(),
+        "video": readahead.stats(),
+    }